@@ -0,0 +1,164 @@
+"""
+Checking projects from asyncio code, without blocking the event loop.
+
+Everything that touches the filesystem or parses anything (reading the
+project file, searching for source files, parsing them, and scanning the
+installed distributions) runs in a bounded pool of threads, and warnings are
+yielded as soon as each stage produces them: first those about the project
+file, then those about dependencies, and last those about dev-dependencies.
+
+Cancelling a check stops it from starting any more work. Files already being
+parsed finish in their threads, and their results are kept in the Analyzer's
+cache for next time.
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import itertools
+from pathlib import Path
+import threading
+from typing import (
+    AsyncIterator, Callable, Iterable, Iterator, List, Optional, Set, Tuple,
+    TypeVar, Union,
+)
+
+from .analyzer import Analyzer
+from .errors import Warn, Warned, safe
+from .imports import external_modules
+from .project import Project, read_poetry
+from .shard import DEPENDENCIES, DEV_DEPENDENCIES
+
+T = TypeVar('T')
+
+DEFAULT_JOBS = 4
+# Files found and parsed by each call to the executor
+BATCH_SIZE = 16
+
+class AsyncAnalyzer:
+    """
+    Wraps an Analyzer for use from asyncio. Up to jobs files are parsed at a
+    time for each check, on executor if specified, or otherwise on a pool of
+    jobs threads owned by this object, which close() shuts down.
+    """
+    def __init__(
+        self, analyzer: Optional[Analyzer] = None,
+        *, jobs: int = DEFAULT_JOBS, executor: Optional[concurrent.futures.Executor] = None,
+    ) -> None:
+        if jobs < 1:
+            raise ValueError(f"jobs must be positive, got {jobs}")
+        self.analyzer = analyzer or Analyzer()
+        self.jobs = jobs
+        self._owned = executor is None
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix='omnidep',
+        )
+
+    async def __aenter__(self) -> AsyncAnalyzer:
+        return self
+
+    async def __aexit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._owned:
+            self.executor.shutdown(wait=False)
+
+    async def _run(self, func: Callable[..., T], *args: object) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def external_modules(self, files: Iterable[Path]) -> List[str]:
+        """
+        Like Analyzer.get_external_modules, parsing up to jobs files at a
+        time. files is only iterated in the executor, so it can be a
+        generator that walks the filesystem.
+        """
+        todo: Iterator[Path] = iter(files)
+        lock = threading.Lock()
+        stop = threading.Event()
+        found: Set[str] = set()
+
+        def read_batch() -> Optional[List[str]]:
+            with lock:
+                batch = list(itertools.islice(todo, BATCH_SIZE))
+            if not batch:
+                return None
+            # Stop between files if the check is cancelled.
+            files = itertools.takewhile(lambda _: not stop.is_set(), batch)
+            return external_modules(itertools.chain.from_iterable(map(self.analyzer.read_imports, files)))
+
+        async def worker() -> None:
+            while True:
+                modules = await self._run(read_batch)
+                if modules is None:
+                    return
+                found.update(modules)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.jobs)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # If one fails, the others stop too.
+            stop.set()
+            for task in workers:
+                task.cancel()
+        return sorted(found)
+
+    async def stream(
+        self, project: Union[Project, Path, None], paths: Iterable[Path] = (),
+        *, tests: Optional[Iterable[Path]] = None,
+    ) -> AsyncIterator[Warn]:
+        """
+        The same warnings as Analyzer.check, in the same order, each yielded
+        as soon as it's known.
+        """
+        loaded: Warned[Project]
+        loaded = safe(project) if isinstance(project, Project) else await self._run(read_poetry, project)
+        for warning in loaded.warnings:
+            yield warning
+        value = loaded.value
+        paths = list(paths)
+        tests = None if tests is None else list(tests)
+        stages = (
+            (DEPENDENCIES, value.dependency_files(paths, exclude=tests or ())),
+            (DEV_DEPENDENCIES, value.dev_dependency_files(tests)),
+        )
+        for label, files in stages:
+            modules = await self.external_modules(files)
+            for warning in await self._run(self._check_label, value, label, modules):
+                yield warning
+
+    def _check_label(self, project: Project, label: str, modules: List[str]) -> Tuple[Warn, ...]:
+        index = self.analyzer.probed_index(project, {label: modules})
+        if label == DEPENDENCIES:
+            return tuple(project.check_dependency_imports(modules, index=index))
+        return tuple(project.check_dev_dependency_imports(modules, index=index))
+
+    async def check(
+        self, project: Union[Project, Path, None], paths: Iterable[Path] = (),
+        *, tests: Optional[Iterable[Path]] = None,
+    ) -> Tuple[Warn, ...]:
+        """Like Analyzer.check"""
+        return tuple([warning async for warning in self.stream(project, paths, tests=tests)])
+
+    async def check_many(
+        self, projects: Iterable[Path], *, limit: int = DEFAULT_JOBS,
+    ) -> AsyncIterator[Tuple[Path, Tuple[Warn, ...]]]:
+        """
+        Check up to limit projects at a time, given by the paths of their
+        pyproject.toml, yielding each one's warnings as soon as it's done. If
+        one fails, or iteration stops early, the rest are cancelled.
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def check_one(project: Path) -> Tuple[Path, Tuple[Warn, ...]]:
+            async with semaphore:
+                return project, await self.check(project)
+
+        tasks = [asyncio.ensure_future(check_one(project)) for project in projects]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import collections
+import itertools
+from pathlib import Path
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from . import bytecode, imports
+from .errors import Warn, Warned, safe
+from .imports import external_modules, top_level
+from .packages import RULE_PROBE, DistributionIndex, canon, current_index
+from .probe import Prober
+from .project import Project, read_poetry
+from .shard import DEPENDENCIES, DEV_DEPENDENCIES, Partial
+
+# (st_mtime_ns, st_size) of a source file when it was parsed.
+Stamp = Tuple[int, int]
+
+class Analyzer:
+    """
+    Checks any number of projects in-process, keeping hold of the work that
+    doesn't need repeating between them: the index of installed
+    distributions, and the imports found in recently-parsed source files.
+
+    Parsed files are held in an LRU cache of at most cache_size entries, so
+    memory use is bounded however many projects are checked. A cached file is
+    parsed again if its modification time or size has changed.
+
+    If cache_dir is specified, the index is persisted there and reused by
+    later processes, until the environment changes.
+
+    If use_bytecode is true, imports are read from up-to-date .pyc files in
+    __pycache__ where possible, instead of parsing the source.
+
+    If probe_imports is true, imports that the index doesn't account for are
+    imported in subprocesses by a Prober, to find out what provides them.
+
+    An Analyzer can be shared between threads: the caches are locked, though
+    files are parsed outside the lock, and the index is scanned or loaded
+    under a lock of its own, so that parsing isn't held up meanwhile.
+    """
+    def __init__(
+        self, *, cache_size: int = 4096, index: Optional[DistributionIndex] = None,
+        cache_dir: Optional[Path] = None, use_bytecode: bool = False, probe_imports: bool = False,
+    ) -> None:
+        if cache_size < 0:
+            raise ValueError(f"cache_size must not be negative, got {cache_size}")
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self.use_bytecode = use_bytecode
+        self._read = bytecode.read_imports if use_bytecode else imports.read_imports
+        self.prober = Prober(cache_dir=cache_dir) if probe_imports else None
+        self._index = index
+        # After refresh(), scan for this Analyzer alone, rather than sharing
+        # the index that current_index() keeps for the process.
+        self._rescan = False
+        self._parsed: collections.OrderedDict[Path, Tuple[Stamp, Tuple[str, ...]]]
+        self._parsed = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def index(self) -> DistributionIndex:
+        """The installed distributions, scanned the first time they're needed"""
+        index = self._index
+        if index is None:
+            with self._index_lock:
+                if self._index is None:
+                    if self.cache_dir is None:
+                        self._index = DistributionIndex.scan() if self._rescan else current_index()
+                    else:
+                        self._index = DistributionIndex.load(self.cache_dir)
+                index = self._index
+        return index
+
+    def refresh(self) -> None:
+        """
+        Forget the installed distributions, for example after installing more.
+        Other Analyzers aren't affected.
+        """
+        with self._index_lock:
+            self._index = None
+            self._rescan = True
+
+    def clear(self) -> None:
+        """Forget all parsed source files"""
+        with self._lock:
+            self._parsed.clear()
+
+    def read_imports(self, file: Path) -> Tuple[str, ...]:
+        """Like imports.read_imports, but cached"""
+        stat = file.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        key = file.absolute()
+        with self._lock:
+            cached = self._parsed.get(key)
+            if cached is not None and cached[0] == stamp:
+                self.hits += 1
+                self._parsed.move_to_end(key)
+                return cached[1]
+            self.misses += 1
+        names = tuple(self._read(file))
+        if self.cache_size > 0:
+            with self._lock:
+                self._parsed[key] = (stamp, names)
+                self._parsed.move_to_end(key)
+                while len(self._parsed) > self.cache_size:
+                    self._parsed.popitem(last=False)
+        return names
+
+    def get_external_modules(self, files: Iterable[Path]) -> List[str]:
+        return external_modules(itertools.chain.from_iterable(map(self.read_imports, files)))
+
+    def find_imports(
+        self, project: Project, paths: Iterable[Path] = (),
+        *, tests: Optional[Iterable[Path]] = None,
+    ) -> Dict[str, List[str]]:
+        """The external modules imported by the project, keyed by the label of the dependencies they're checked against"""
+        tests = None if tests is None else list(tests)
+        return {
+            DEPENDENCIES: self.get_external_modules(project.dependency_files(paths, exclude=tests or ())),
+            DEV_DEPENDENCIES: self.get_external_modules(project.dev_dependency_files(tests)),
+        }
+
+    def probed_index(self, project: Project, found: Dict[str, List[str]]) -> DistributionIndex:
+        """The index, plus what import probes say about any imports it doesn't account for"""
+        if self.prober is None:
+            return self.index
+        local_packages = project.local_packages | set(project.config.local_test_packages)
+        unresolved = set(
+            top_level(module)
+            for modules in found.values() for module in modules
+            if not project.ignore_import(module)
+            and canon(top_level(module)) not in local_packages
+            and not self.index.resolve(module)[1]
+        )
+        answers = {module: dists for module, dists in self.prober.distributions(unresolved).items() if dists}
+        return self.index.with_modules(answers, RULE_PROBE) if answers else self.index
+
+    def check_imports(self, project: Warned[Project], found: Dict[str, List[str]]) -> Tuple[Warn, ...]:
+        """Check a project against the imports from find_imports"""
+        partial = Partial(imports={label: frozenset(modules) for label, modules in found.items()})
+        return partial.check(project, index=self.probed_index(project.value, found))
+
+    def check(
+        self, project: Union[Project, Path, None], paths: Iterable[Path] = (),
+        *, tests: Optional[Iterable[Path]] = None,
+    ) -> Tuple[Warn, ...]:
+        """
+        Check a project, given either as a Project or as the path of its
+        pyproject.toml, and return all warnings found.
+
+        paths and tests are as for the command-line: extra places to search
+        for non-test and test code respectively.
+        """
+        loaded: Warned[Project]
+        loaded = safe(project) if isinstance(project, Project) else read_poetry(project)
+        return self.check_imports(loaded, self.find_imports(loaded.value, paths, tests=tests))
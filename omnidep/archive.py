@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+import email.parser
+import logging
+import os
+from pathlib import Path, PurePosixPath
+import sys
+import tarfile
+from typing import (
+    Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple,
+)
+import zipfile
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+from .analyzer import Analyzer
+from .command import Config
+from .errors import Warn
+from .imports import external_modules, parse_imports
+from .packages import canon, requirement_names
+from .project import Project, parse_poetry, read_poetry
+from .shard import DEPENDENCIES, DEV_DEPENDENCIES
+
+logger = logging.getLogger()
+
+WHEEL_SUFFIXES = ('.whl',)
+SDIST_SUFFIXES = ('.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.zip')
+
+def is_wheel(path: Path) -> bool:
+    return path.name.lower().endswith(WHEEL_SUFFIXES)
+
+def is_sdist(path: Path) -> bool:
+    return path.name.lower().endswith(SDIST_SUFFIXES)
+
+def is_archive(path: Path) -> bool:
+    return is_wheel(path) or is_sdist(path)
+
+# (path within the archive, function to read the member's contents)
+Member = Tuple[PurePosixPath, Callable[[], bytes]]
+
+def iter_members(archive: Path) -> Iterable[Member]:
+    """
+    Stream the regular files out of a zip or tar archive, without extracting
+    them to disk. Each reader must be called, if at all, before moving on to
+    the next member: tar archives are read in a single pass.
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zipped:
+            for info in zipped.infolist():
+                if not info.is_dir():
+                    def read_zipped(info: zipfile.ZipInfo = info) -> bytes:
+                        return zipped.read(info)
+                    yield PurePosixPath(info.filename), read_zipped
+        return
+    # "r|*" is a stream, so we never seek backwards or hold the whole thing
+    with tarfile.open(archive, 'r|*') as tarred:
+        for member in tarred:
+            if member.isfile():
+                def read_tarred(member: tarfile.TarInfo = member) -> bytes:
+                    infile = tarred.extractfile(member)
+                    return infile.read() if infile else b''
+                yield PurePosixPath(member.name), read_tarred
+
+@dataclass
+class Contents:
+    """The parts of an archive that omnidep needs, read in one pass"""
+    # Imports found in each .py file, keyed by path relative to the project root
+    imports: Dict[PurePosixPath, List[str]] = field(default_factory=dict)
+    metadata: Optional[str] = None
+    pyproject: Optional[Dict[str, Any]] = None
+
+def read_archive(archive: Path) -> Contents:
+    wheel = is_wheel(archive)
+    contents = Contents()
+    for member, read in iter_members(archive):
+        # Everything in an sdist is in a directory named for the project.
+        name = member if wheel else PurePosixPath(*member.parts[1:])
+        if len(name.parts) == 0:
+            continue
+        if wheel and name.parts[0].endswith('.dist-info'):
+            if len(name.parts) == 2 and name.name == 'METADATA':
+                contents.metadata = read().decode('utf8')
+        elif not wheel and str(name) == 'PKG-INFO':
+            contents.metadata = read().decode('utf8')
+        elif not wheel and str(name) == 'pyproject.toml':
+            contents.pyproject = tomllib.loads(read().decode('utf8'))
+        elif name.suffix == '.py':
+            contents.imports[name] = parse_imports(read())
+    if contents.metadata is None:
+        raise FileNotFoundError(f"No {'METADATA' if wheel else 'PKG-INFO'} found in {str(archive)!r}")
+    return contents
+
+def requires_dist(metadata: str) -> FrozenSet[str]:
+    """Canonical names of the distributions listed in Requires-Dist"""
+    message = email.parser.Parser().parsestr(metadata, headersonly=True)
+    return requirement_names(message.get_all('Requires-Dist') or ())
+
+def top_level_names(paths: Iterable[PurePosixPath]) -> FrozenSet[str]:
+    """The packages and modules found at the top level of the archive"""
+    return frozenset(
+        canon(path.parts[0] if len(path.parts) > 1 else path.stem)
+        for path in paths
+        if not path.parts[0].endswith(('.dist-info', '.data'))
+    )
+
+def relative_test_paths(config: Config, toml_file: Optional[Path]) -> List[PurePosixPath]:
+    root = toml_file.parent if toml_file else Path()
+    return [PurePosixPath(Path(os.path.relpath(path, root)).as_posix()) for path in config.local_test_paths]
+
+def is_under(path: PurePosixPath, parents: Iterable[PurePosixPath]) -> bool:
+    return any(parent == path or parent in path.parents for parent in parents)
+
+def check_archive(
+    archive: Path, toml_file: Optional[Path] = None,
+    *, analyzer: Optional[Analyzer] = None,
+) -> Tuple[Warn, ...]:
+    """
+    Check the code in a wheel or sdist against the dependencies it declares in
+    its metadata.
+
+    The [tool.omnidep] config, and any dev-dependencies, come from toml_file if
+    it's specified. Otherwise they come from the pyproject.toml in the sdist,
+    if any (there isn't one in a wheel).
+    """
+    logger.info(f"reading {archive}")
+    contents = read_archive(archive)
+    requires = requires_dist(contents.metadata or '')
+    sources = contents.imports
+    if contents.pyproject is not None and 'poetry' in contents.pyproject.get('tool', {}):
+        shipped = parse_poetry(contents.pyproject).value
+        # The sdist can contain other code (setup.py, docs, ...) that isn't
+        # part of the project.
+        included = [PurePosixPath(path.as_posix()) for path in shipped.extra_paths]
+        included.extend(relative_test_paths(shipped.config, None))
+        sources = {path: names for path, names in sources.items() if is_under(path, included)}
+    else:
+        shipped = Project((), (), Config.make())
+    base = shipped if toml_file is None else read_poetry(toml_file).value
+    tests = relative_test_paths(base.config, toml_file)
+    project = replace(
+        base,
+        dependencies=requires,
+        dev_dependencies=requires | (frozenset(base.dev_dependencies) - frozenset(base.dependencies)),
+        local_packages=top_level_names(path for path in sources if not is_under(path, tests)),
+    )
+    def modules(*, test: bool) -> List[str]:
+        return external_modules(
+            name
+            for path, names in sources.items() if is_under(path, tests) == test
+            for name in names
+        )
+    found = {DEPENDENCIES: modules(test=False), DEV_DEPENDENCIES: modules(test=True)}
+    index = (analyzer or Analyzer()).probed_index(project, found)
+    return (
+        *project.check_dependency_imports(found[DEPENDENCIES], index=index),
+        *project.check_dev_dependency_imports(found[DEV_DEPENDENCIES], index=index),
+    )
@@ -0,0 +1,187 @@
+"""
+Reading imports from the bytecode that Python caches in __pycache__, instead
+of parsing the source, when the cache is up to date. Test runs leave fresh
+.pyc files behind, and unmarshalling one is much cheaper than ast.parse.
+
+The results are the same as from imports.read_imports, except for order, and
+that an import can be repeated where the compiler duplicates code (as it does
+for "finally" blocks).
+"""
+from __future__ import annotations
+
+import dis
+import importlib.util
+import marshal
+from pathlib import Path
+import re
+from types import CodeType
+from typing import Iterable, List, Optional, Tuple
+
+from . import imports
+
+# Size of the .pyc header: magic, flags, then mtime and size, or source hash.
+HEADER_SIZE = 16
+FLAG_HASH_BASED = 0b01
+FLAG_CHECK_SOURCE = 0b10
+
+# Lines where the keyword "import" appears before any comment or string. This
+# is rough: it may well match text in docstrings, but it can only miss import
+# statements that follow a string on the same line.
+import_line = re.compile(rb'^[^#\'"\n]*\bimport\b', re.MULTILINE)
+
+# Bytecode is in units of (opcode, argument) bytes.
+UNIT = 2
+IMPORT_NAME = bytes([dis.opmap['IMPORT_NAME']])
+EXTENDED_ARG = dis.opmap['EXTENDED_ARG']
+LOAD_CONST = dis.opmap['LOAD_CONST']
+# Python 3.14+ loads small ints specially. Python 3.11+ has inline caches.
+LOAD_SMALL_INT = dis.opmap.get('LOAD_SMALL_INT')
+CACHE = dis.opmap.get('CACHE')
+
+# Not a constant that can be loaded, so it doesn't match any expected type.
+NOT_CONSTANT = object()
+
+def _const(code: CodeType, op: int, arg: int) -> object:
+    if op == LOAD_CONST:
+        return code.co_consts[arg]
+    if op == LOAD_SMALL_INT:  # pragma: no cover
+        return arg
+    return NOT_CONSTANT
+
+def _uint32(data: bytes) -> int:
+    return int.from_bytes(data, 'little')
+
+def is_fresh(header: bytes, file: Path, source: bytes) -> bool:
+    """
+    Whether a .pyc header says that it was compiled from source, by this
+    version of Python, using the same checks that the import system does.
+    """
+    if len(header) < HEADER_SIZE or header[:4] != importlib.util.MAGIC_NUMBER:
+        return False
+    flags = _uint32(header[4:8])
+    if flags & ~(FLAG_HASH_BASED | FLAG_CHECK_SOURCE):
+        return False
+    if flags & FLAG_HASH_BASED:
+        # Check the hash even if the pyc says not to: we have the source.
+        return header[8:16] == importlib.util.source_hash(source)
+    stat = file.stat()
+    return (
+        _uint32(header[8:12]) == int(stat.st_mtime) & 0xFFFFFFFF
+        and _uint32(header[12:16]) == stat.st_size & 0xFFFFFFFF
+    )
+
+def cached_code(file: Path, source: bytes) -> Optional[CodeType]:
+    """The code object cached for file, if the cache is fresh"""
+    try:
+        data = Path(importlib.util.cache_from_source(str(file))).read_bytes()
+    except (NotImplementedError, OSError):
+        # NotImplementedError means this interpreter doesn't cache bytecode.
+        return None
+    if not is_fresh(data[:HEADER_SIZE], file, source):
+        return None
+    try:
+        # Written by this version of Python (for the magic number to match),
+        # and we never execute it.
+        code = marshal.loads(data[HEADER_SIZE:])  # noqa: S302
+    except (EOFError, ValueError, TypeError):
+        return None
+    return code if isinstance(code, CodeType) else None
+
+def _instruction_before(code: bytes, end: int) -> Tuple[int, int, int]:
+    """
+    Decode the instruction that ends just before offset end in co_code, by
+    reading backwards. Returns (start offset, opcode, argument).
+    """
+    pos = end - UNIT
+    while pos >= 0 and code[pos] == CACHE:
+        pos -= UNIT
+    if pos < 0:
+        return -1, -1, 0
+    op, arg, shift = code[pos], code[pos + 1], 8
+    while pos >= UNIT and code[pos - UNIT] == EXTENDED_ARG:
+        pos -= UNIT
+        arg |= code[pos + 1] << shift
+        shift += 8
+    return pos, op, arg
+
+def _line_of(code: CodeType, offset: int) -> int:
+    line = 0
+    for start, lineno in dis.findlinestarts(code):
+        if start > offset:
+            break
+        line = lineno or line
+    return line
+
+def code_imports(code: CodeType) -> Optional[List[Tuple[List[str], int]]]:
+    """
+    For each IMPORT_NAME in code, and in the code nested in it: the names it
+    imports, by the same rules as imports.iter_import_names, and the line of
+    the statement. None if the bytecode isn't in the expected form.
+
+    Only the opcodes are searched (which is fast), then the level and fromlist
+    are read from the two instructions that load them.
+    """
+    results = []
+    to_process = [code]
+    while to_process:
+        code = to_process.pop()
+        to_process.extend(const for const in code.co_consts if isinstance(const, CodeType))
+        co_code = code.co_code
+        opcodes = co_code[::UNIT]
+        found = opcodes.find(IMPORT_NAME)
+        while found >= 0:
+            offset = found * UNIT
+            start, _, name_idx = _instruction_before(co_code, offset + UNIT)
+            start, *fromlist_load = _instruction_before(co_code, start)
+            _, *level_load = _instruction_before(co_code, start)
+            level, fromlist = _const(code, *level_load), _const(code, *fromlist_load)
+            if not isinstance(level, int) or not isinstance(fromlist, (tuple, type(None))):
+                return None
+            names: List[str] = []
+            if level == 0:
+                module = code.co_names[name_idx]
+                if fromlist is None:
+                    names.append(module)
+                else:
+                    names.extend(module if name == '*' else f'{module}.{name}' for name in fromlist)
+            results.append((names, _line_of(code, offset)))
+            found = opcodes.find(IMPORT_NAME, found + 1)
+    return results
+
+def import_lines(source: bytes) -> Iterable[int]:
+    """Numbers of the lines that might contain import statements"""
+    line, pos = 1, 0
+    for match in import_line.finditer(source):
+        line += source.count(b'\n', pos, match.start())
+        pos = match.start()
+        yield line
+
+def cached_imports(file: Path) -> Optional[List[str]]:
+    """
+    The imports in file, read from its cached bytecode, or None if that
+    isn't possible.
+
+    The compiler discards unreachable code, like "if False:" blocks, along with
+    any imports in it. So if there's a line in the source that might be an
+    import, and there's no import there in the bytecode, give up.
+    """
+    source = file.read_bytes()
+    code = cached_code(file, source)
+    if code is None:
+        return None
+    found = code_imports(code)
+    if found is None:
+        return None
+    # Only the first line of each import statement is known, so one with a
+    # line break before the keyword "import" is parsed instead.
+    covered = set(line for _, line in found)
+    if not covered.issuperset(import_lines(source)):
+        return None
+    return [name for names, _ in found for name in names]
+
+def read_imports(file: Path) -> List[str]:
+    """Like imports.read_imports, but using the cached bytecode if possible"""
+    names = cached_imports(file)
+    if names is None:
+        return imports.read_imports(file)
+    return names
@@ -5,9 +5,10 @@ import argparse
 from dataclasses import dataclass, field, fields
 import logging
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Type, TypeVar
 
 from .errors import ConfigError
+from .shard import Shard
 
 # TODO - Python 3.11 will have public logging.getLevelNamesMapping
 # https://github.com/python/cpython/issues/88024
@@ -21,13 +22,23 @@ log_levels = tuple(p[1] for p in sorted(logging._levelToName.items()))
 # work on an upgrade treadmill ensuring I always support every version of
 # click. So, argparse it is.
 parser = argparse.ArgumentParser(description="Check project dependencies against imports in code.")
+merge_parser = argparse.ArgumentParser(
+    prog='omnidep merge',
+    description="Check project dependencies against the imports found by 'omnidep --shard'.",
+)
+which_parser = argparse.ArgumentParser(
+    prog='omnidep which',
+    description="Say which distribution provides each module, and by what rule.",
+)
 
 CLT = TypeVar('CLT', bound='BasicCommandLine')
 
 @dataclass
 class BasicCommandLine:
+    parser: ClassVar[argparse.ArgumentParser]
     _log_level: Optional[str] = None
     verbose: bool = False
+    cache_dir: Optional[Path] = None
 
     @property
     def log_level(self) -> Optional[str]:
@@ -37,32 +48,103 @@ class BasicCommandLine:
 
     @classmethod
     def parse(cls: Type[CLT], args: Optional[List[str]] = None) -> CLT:
-        return parser.parse_args(args=args, namespace=cls())
+        return cls.parser.parse_args(args=args, namespace=cls())
 
     @classmethod
     def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
         parser.add_argument('--log-level', choices=log_levels, dest='_log_level')
         parser.add_argument('--verbose', '-v', action='store_true', default=False)
+        parser.add_argument(
+            '--cache-dir', metavar='PATH', type=Path,
+            help="keep the index of installed distributions here, to reuse until the environment changes",
+        )
 
 @dataclass
 class CommandLine(BasicCommandLine):
+    parser: ClassVar[argparse.ArgumentParser] = parser
     paths: List[Path] = field(default_factory=list)
     project: Optional[Path] = None
     tests: Optional[List[Path]] = None
+    shard: Optional[Shard] = None
+    output: Optional[Path] = None
+    use_bytecode: bool = False
+    probe_imports: bool = False
+    git_range: Optional[str] = None
 
     @classmethod
     def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
         parser.add_argument('paths', metavar='PATH', nargs='+', type=Path)
         parser.add_argument('--project', metavar='PATH', type=Path)
         parser.add_argument('--tests', metavar='PATH', action='append', type=Path)
+        parser.add_argument(
+            '--shard', metavar='I/N', type=Shard.parse,
+            help="only search part I of N of the source files, and write the imports to --output for 'omnidep merge'",
+        )
+        parser.add_argument('--output', metavar='PATH', type=Path, help="where to write the imports found by --shard")
+        parser.add_argument(
+            '--use-bytecode', action='store_true', default=False,
+            help="read imports from up-to-date .pyc files in __pycache__ where possible, instead of parsing",
+        )
+        parser.add_argument(
+            '--probe-imports', action='store_true', default=False,
+            help="import modules that the installed metadata doesn't account for, in subprocesses, to find what provides them",
+        )
+        parser.add_argument(
+            '--git-range', metavar='A..B',
+            help="check each commit in a range of git history, reading it from the repository, and report the changes in warnings",
+        )
         super().add_arguments(parser)
 
 CommandLine.add_arguments(parser)
 
+@dataclass
+class MergeCommandLine(BasicCommandLine):
+    parser: ClassVar[argparse.ArgumentParser] = merge_parser
+    paths: List[Path] = field(default_factory=list)
+    project: Optional[Path] = None
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument('paths', metavar='PATH', nargs='+', type=Path, help="pyproject.toml, and the files written by --shard")
+        parser.add_argument('--project', metavar='PATH', type=Path)
+        super().add_arguments(parser)
+
+MergeCommandLine.add_arguments(merge_parser)
+
+@dataclass
+class WhichCommandLine(BasicCommandLine):
+    parser: ClassVar[argparse.ArgumentParser] = which_parser
+    modules: List[str] = field(default_factory=list)
+    project: Optional[Path] = None
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            'modules', metavar='MODULE', nargs='+',
+            help="dotted module name, or '-' to read names from stdin, one per line",
+        )
+        parser.add_argument('--project', metavar='PATH', type=Path, help="pyproject.toml, for the project's own packages")
+        super().add_arguments(parser)
+
+WhichCommandLine.add_arguments(which_parser)
+
+# Subcommands are recognised by the first argument. Anything else is a path
+# for the default command.
+subcommands: Dict[str, Type[BasicCommandLine]] = {
+    'merge': MergeCommandLine,
+    'which': WhichCommandLine,
+}
+
+def parse_command_line(args: List[str]) -> BasicCommandLine:
+    if args and args[0] in subcommands:
+        return subcommands[args[0]].parse(args[1:])
+    return CommandLine.parse(args)
+
 @dataclass(frozen=True)
 class Config:
     ignore_imports: List[str] = field(default_factory=list)
     child_packages: Dict[str, List[str]] = field(default_factory=dict)
+    infer_child_packages: bool = False
     ignore_dependencies: List[str] = field(default_factory=list)
     local_test_packages: List[str] = field(default_factory=list)
     local_test_paths: List[Path] = field(default_factory=list)
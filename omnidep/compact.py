@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from array import array
+import mmap
+import sys
+from typing import Iterable, Iterator, Mapping, Tuple, Union
+
+# Header: magic, number of keys, number of values, number of distinct values,
+# length of key text, length of value text.
+MAGIC = 0x5045444f  # b'ODEP' little-endian
+HEADER_ITEMS = 6
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+def _uint32s(values: Iterable[int]) -> array[int]:
+    result = array('I', values)
+    if result.itemsize != 4:  # pragma: no cover
+        raise NotImplementedError("array('I') is not 32 bits on this platform")
+    return result
+
+def _running_totals(counts: Iterable[int]) -> array[int]:
+    """Running totals, starting from 0"""
+    totals = [0]
+    for count in counts:
+        totals.append(totals[-1] + count)
+    return _uint32s(totals)
+
+def _offsets(chunks: Iterable[bytes]) -> Tuple[array[int], bytes]:
+    """Concatenate chunks, and return their start offsets (plus the end)"""
+    chunks = list(chunks)
+    return _running_totals(map(len, chunks)), b''.join(chunks)
+
+def _pad(data: bytes) -> bytes:
+    return data + b'\0' * (-len(data) % 4)
+
+class CompactMap(Mapping[str, Tuple[str, ...]]):
+    """
+    Immutable mapping from str to tuple of str, held in one flat buffer: a
+    sorted table of keys, and a table of distinct values that keys refer to
+    by number. Values are decoded once, and interned. Keys are only decoded
+    when looked up or iterated.
+
+    The buffer can be anything that supports the buffer protocol, including
+    an mmap of a file written from tobytes(). Integers are native-endian, so
+    such a file is only for use on the machine that wrote it.
+    """
+    def __init__(self, buffer: Buffer) -> None:
+        view = memoryview(buffer)
+        if len(view) < HEADER_ITEMS * 4:
+            raise ValueError("CompactMap is truncated")
+        header = view[:HEADER_ITEMS * 4].cast('I')
+        magic, nkeys, nvals, ndistinct, key_len, distinct_len = header
+        if magic != MAGIC:
+            raise ValueError("not a CompactMap")
+        pos = HEADER_ITEMS * 4
+        def take(size: int) -> memoryview:
+            nonlocal pos
+            part = view[pos:pos + size]
+            if len(part) != size:
+                raise ValueError("CompactMap is truncated")
+            # Every part is padded to keep the integers aligned.
+            pos += size + (-size % 4)
+            return part
+        self._key_offsets = take(4 * (nkeys + 1)).cast('I')
+        self._value_offsets = take(4 * (nkeys + 1)).cast('I')
+        self._value_ids = take(4 * nvals).cast('I')
+        distinct_offsets = take(4 * (ndistinct + 1)).cast('I')
+        self._keys = take(key_len)
+        distinct_text = bytes(take(distinct_len))
+        self._distinct = tuple(
+            sys.intern(distinct_text[start:end].decode('utf8'))
+            for start, end in zip(distinct_offsets, distinct_offsets[1:])
+        )
+        # Size in bytes of the buffer.
+        self.nbytes = pos
+        self._buffer = view[:pos]
+
+    @classmethod
+    def build(cls, items: Mapping[str, Iterable[str]]) -> CompactMap:
+        return cls(cls.to_bytes(items))
+
+    @staticmethod
+    def to_bytes(items: Mapping[str, Iterable[str]]) -> bytes:
+        keys = sorted((key.encode('utf8'), key) for key in items)
+        values = [sorted(set(items[key])) for _, key in keys]
+        distinct = sorted(set(value for vals in values for value in vals))
+        numbers = {value: idx for idx, value in enumerate(distinct)}
+        key_offsets, key_text = _offsets(encoded for encoded, _ in keys)
+        value_offsets = _running_totals(map(len, values))
+        value_ids = _uint32s(numbers[value] for vals in values for value in vals)
+        distinct_offsets, distinct_text = _offsets(value.encode('utf8') for value in distinct)
+        header = _uint32s([MAGIC, len(keys), len(value_ids), len(distinct), len(key_text), len(distinct_text)])
+        return b''.join([
+            header.tobytes(),
+            key_offsets.tobytes(),
+            value_offsets.tobytes(),
+            value_ids.tobytes(),
+            distinct_offsets.tobytes(),
+            _pad(key_text),
+            _pad(distinct_text),
+        ])
+
+    def tobytes(self) -> bytes:
+        return self._buffer.tobytes()
+
+    def _key(self, idx: int) -> bytes:
+        return bytes(self._keys[self._key_offsets[idx]:self._key_offsets[idx + 1]])
+
+    def _find(self, key: bytes, lo: int = 0, hi: int = -1) -> int:
+        """Index of the first key >= key, in the range [lo, hi)"""
+        if hi < 0:
+            hi = len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _value(self, idx: int) -> Tuple[str, ...]:
+        ids = self._value_ids[self._value_offsets[idx]:self._value_offsets[idx + 1]]
+        return tuple(self._distinct[num] for num in ids)
+
+    def walk(self, key: str, sep: str = '.') -> Iterator[Tuple[str, Tuple[str, ...]]]:
+        """
+        Treating the keys as paths in a trie, split at sep, yield (prefix,
+        value) for each prefix of key that's present, shortest first. Stops at
+        the first prefix that isn't present.
+
+        Since the keys are sorted, all keys under a prefix are contiguous, so
+        each step searches only the range of keys under the previous one.
+        """
+        parts = key.split(sep)
+        after_sep = bytes([ord(sep) + 1])
+        lo, hi = 0, len(self)
+        for depth in range(1, len(parts) + 1):
+            prefix = sep.join(parts[:depth]).encode('utf8')
+            idx = self._find(prefix, lo, hi)
+            if idx >= hi or self._key(idx) != prefix:
+                return
+            yield prefix.decode('utf8'), self._value(idx)
+            lo, hi = idx + 1, self._find(prefix + after_sep, idx + 1, hi)
+
+    def __getitem__(self, key: str) -> Tuple[str, ...]:
+        encoded = key.encode('utf8')
+        idx = self._find(encoded)
+        if idx < len(self) and self._key(idx) == encoded:
+            return self._value(idx)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for idx in range(len(self)):
+            yield self._key(idx).decode('utf8')
+
+    def __len__(self) -> int:
+        return len(self._key_offsets) - 1
+
+    def __repr__(self) -> str:
+        return f"<CompactMap of {len(self)} keys, {self.nbytes} bytes>"
+
+class LayeredMap(Mapping[str, Tuple[str, ...]]):
+    """
+    Immutable mapping from str to tuple of str that adds the values in extra
+    to those in base, without copying base. Each value is the sorted union of
+    its values in both, as in CompactMap, so extra should be small.
+    """
+    def __init__(self, base: Mapping[str, Iterable[str]], extra: Mapping[str, Iterable[str]]) -> None:
+        self.base = base
+        self.extra = {key: tuple(sorted(set(base.get(key, ())) | set(values))) for key, values in extra.items()}
+
+    def __getitem__(self, key: str) -> Tuple[str, ...]:
+        if key in self.extra:
+            return self.extra[key]
+        return tuple(self.base[key])
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.base
+        yield from (key for key in self.extra if key not in self.base)
+
+    def __len__(self) -> int:
+        return len(self.base) + sum(key not in self.base for key in self.extra)
+
+    def __repr__(self) -> str:
+        return f"<LayeredMap of {len(self.extra)} keys over {self.base!r}>"
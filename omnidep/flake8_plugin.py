@@ -0,0 +1,172 @@
+"""
+A flake8 plugin, so that a project which runs flake8 anyway needn't have every
+file parsed twice. The imports in each file are checked using the tree that
+flake8 has already parsed, and reported at the import statement: these are
+ODEP001 to ODEP004, and ODEP008.
+
+The project-level checks (for unused dependencies, and the project file
+itself) need the imports from the whole project, and flake8 has no hook for
+the end of a run. So with --omnidep-partials DIR, each of flake8's worker
+processes appends the imports it finds to its own file in DIR, and afterwards
+"omnidep merge pyproject.toml DIR/*.jsonl" does the project-level checks.
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import functools
+import logging
+import os
+from pathlib import Path
+import sys
+from typing import (
+    Any, ClassVar, Dict, Iterable, List, Optional, Set, Tuple, Type,
+)
+
+if sys.version_info < (3, 8):
+    import importlib_metadata as metadata
+else:
+    from importlib import metadata
+
+from .analyzer import Analyzer
+from .errors import Warn
+from .imports import import_names, is_external, iter_import_nodes, top_level
+from .project import is_under, read_poetry
+from .shard import DEPENDENCIES, DEV_DEPENDENCIES, write_partial
+
+logger = logging.getLogger()
+
+# What flake8 expects a plugin to report: line, column, message, and type.
+Result = Tuple[int, int, str, Type[Any]]
+
+class ProjectChecker:
+    """
+    What a flake8 worker process keeps between files: the project, the index
+    of installed distributions, and the warnings for each import.
+    """
+    def __init__(self, project_file: Path, cache_dir: Optional[Path] = None, partials: Optional[Path] = None) -> None:
+        self.project = read_poetry(project_file).value
+        self.index = Analyzer(cache_dir=cache_dir).index
+        self.source_paths = [path.resolve() for path in self.project.extra_paths]
+        self.test_paths = [path.resolve() for path in self.project.config.local_test_paths]
+        self.output = None
+        if partials is not None:
+            partials.mkdir(parents=True, exist_ok=True)
+            self.output = partials / f'flake8-{os.getpid()}.jsonl'
+        self._checked: Dict[Tuple[str, str], Tuple[Warn, ...]] = {}
+        self._written: Dict[str, Set[str]] = {DEPENDENCIES: set(), DEV_DEPENDENCIES: set()}
+
+    def label(self, filename: str) -> Optional[str]:
+        """
+        Which dependencies the imports in a file are checked against, or None
+        if omnidep wouldn't check the file: it's not in the project's
+        packages or local-test-paths, like a setup.py or docs/conf.py.
+        """
+        path = Path(filename).resolve()
+        if any(is_under(path, test) for test in self.test_paths):
+            return DEV_DEPENDENCIES
+        if any(is_under(path, source) for source in self.source_paths):
+            return DEPENDENCIES
+        return None
+
+    def check_module(self, module: str, label: str) -> Tuple[Warn, ...]:
+        key = (label, module)
+        if key not in self._checked:
+            if label == DEV_DEPENDENCIES:
+                found = self.project.check_dev_dependency_imports([module], index=self.index)
+            else:
+                found = self.project.check_dependency_imports([module], index=self.index, check_unused=False)
+            self._checked[key] = tuple(found)
+        return self._checked[key]
+
+    def check(self, tree: ast.AST, filename: str) -> List[Tuple[ast.stmt, Warn]]:
+        """The warnings for each import statement in a file"""
+        label = self.label(filename)
+        if label is None:
+            return []
+        modules: Set[str] = set()
+        results: List[Tuple[ast.stmt, Warn]] = []
+        for node in iter_import_nodes(tree):
+            # One statement can import several names that come down to the
+            # same warning, so report each warning once per statement.
+            warnings: Dict[Warn, None] = {}
+            for module in import_names(node):
+                if is_external(top_level(module)):
+                    modules.add(module)
+                    warnings.update(dict.fromkeys(self.check_module(module, label)))
+            results.extend((node, warning) for warning in warnings)
+        self.record(label, modules)
+        return sorted(results, key=lambda result: (result[0].lineno, result[0].col_offset))
+
+    def record(self, label: str, modules: Iterable[str]) -> None:
+        """Append any imports not already written to this worker's partial file"""
+        new = set(modules) - self._written[label]
+        if self.output is not None and new:
+            write_partial(self.output, None, {label: sorted(new)}, append=True)
+            self._written[label].update(new)
+
+@functools.lru_cache(maxsize=None)
+def project_checker(project_file: Path, cache_dir: Optional[Path], partials: Optional[Path]) -> Optional[ProjectChecker]:
+    """
+    One ProjectChecker per worker process, or None if the project can't be
+    read. The plugin can be enabled in a config shared with projects that
+    don't use poetry or have no pyproject.toml, so that's not an error.
+    """
+    try:
+        return ProjectChecker(project_file, cache_dir, partials)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"omnidep: not checking imports, since {project_file} isn't a usable poetry project ({e!r})")
+        return None
+
+def _version() -> str:
+    try:
+        return metadata.version('omnidep')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+class Plugin:
+    """
+    The flake8 entry point, for codes starting ODEP. It's off unless enabled
+    with --enable-extensions ODE, since installing omnidep somewhere shouldn't
+    change the result of every flake8 run there.
+    """
+    name = 'omnidep'
+    version = _version()
+    off_by_default = True
+    project_file: ClassVar[Path] = Path('pyproject.toml')
+    cache_dir: ClassVar[Optional[Path]] = None
+    partials: ClassVar[Optional[Path]] = None
+
+    def __init__(self, tree: ast.AST, filename: str) -> None:
+        self.tree = tree
+        self.filename = filename
+
+    @classmethod
+    def add_options(cls, option_manager: Any) -> None:
+        """option_manager is a flake8.options.manager.OptionManager"""
+        option_manager.add_option(
+            '--omnidep-project', metavar='PATH', default='pyproject.toml',
+            parse_from_config=True, normalize_paths=True,
+            help="the project file to check imports against (default: %(default)s)",
+        )
+        option_manager.add_option(
+            '--omnidep-cache-dir', metavar='PATH', parse_from_config=True, normalize_paths=True,
+            help="as for 'omnidep --cache-dir'",
+        )
+        option_manager.add_option(
+            '--omnidep-partials', metavar='DIR', parse_from_config=True, normalize_paths=True,
+            help="write the imports found to DIR, for the project-level checks by 'omnidep merge'",
+        )
+
+    @classmethod
+    def parse_options(cls, options: argparse.Namespace) -> None:
+        cls.project_file = Path(options.omnidep_project)
+        cls.cache_dir = None if options.omnidep_cache_dir is None else Path(options.omnidep_cache_dir)
+        cls.partials = None if options.omnidep_partials is None else Path(options.omnidep_partials)
+
+    def run(self) -> Iterable[Result]:
+        checker = project_checker(self.project_file, self.cache_dir, self.partials)
+        if checker is None:
+            return
+        for node, warning in checker.check(self.tree, self.filename):
+            yield node.lineno, node.col_offset, f"{warning.code.name} {warning.msg}", type(self)
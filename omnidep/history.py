@@ -0,0 +1,199 @@
+"""
+Checking every commit in a range of git history, without checking any of them
+out. Commits, trees and files are read straight from the object store through
+one "git cat-file --batch" process, and the imports in each file are found
+once per blob, so a file that's unchanged across commits is only parsed once.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import itertools
+import logging
+import os
+from pathlib import Path, PurePosixPath
+import subprocess
+import sys
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple, cast
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+from .analyzer import Analyzer
+from .errors import ConfigError, Warn
+from .imports import external_modules, parse_imports
+from .project import parse_poetry
+from .shard import DEPENDENCIES, DEV_DEPENDENCIES
+
+logger = logging.getLogger()
+
+# Modes of tree entries
+MODE_TREE = b'40000'
+MODE_FILES = (b'100644', b'100755')
+
+def git(repo: Path, *args: str) -> str:
+    try:
+        result = subprocess.run(
+            ['git', *args], cwd=repo, check=True, capture_output=True, text=True,  # noqa: S603, S607: git from PATH
+        )
+    except subprocess.CalledProcessError as e:
+        raise ConfigError(f"git {' '.join(args)} failed: {e.stderr.strip()}") from None
+    return result.stdout
+
+class GitObjects:
+    """Reads objects from a repository through one 'git cat-file --batch' process"""
+    def __init__(self, repo: Path) -> None:
+        self.proc = subprocess.Popen(
+            ['git', 'cat-file', '--batch'], cwd=repo,  # noqa: S603, S607: git from PATH
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        self._in = cast(IO[bytes], self.proc.stdin)
+        self._out = cast(IO[bytes], self.proc.stdout)
+        self._trees: Dict[str, List[Tuple[bytes, str, str]]] = {}
+
+    def __enter__(self) -> GitObjects:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._in.close()
+        self.proc.wait()
+        self._out.close()
+
+    def read(self, sha: str) -> Tuple[str, bytes]:
+        """The type and contents of an object"""
+        self._in.write(sha.encode('ascii') + b'\n')
+        self._in.flush()
+        header = self._out.readline().split()
+        if len(header) != 3:
+            raise ConfigError(f"git object {sha!r} not found")
+        data = self._out.read(int(header[2]))
+        self._out.read(1)
+        return header[1].decode('ascii'), data
+
+    def commit(self, sha: str) -> Tuple[str, str]:
+        """The root tree of a commit, and its subject line"""
+        _, data = self.read(sha)
+        headers, _, message = data.partition(b'\n\n')
+        tree = headers.split(b'\n', 1)[0].split()[1].decode('ascii')
+        return tree, message.decode('utf8', 'replace').partition('\n')[0]
+
+    def tree(self, sha: str) -> List[Tuple[bytes, str, str]]:
+        """(mode, name, sha) for the entries in a tree. Cached, since most trees are unchanged between commits."""
+        if sha not in self._trees:
+            _, data = self.read(sha)
+            entries = []
+            pos = 0
+            while pos < len(data):
+                space = data.index(b' ', pos)
+                nul = data.index(b'\0', space)
+                name = data[space + 1:nul].decode('utf8', 'surrogateescape')
+                entries.append((data[pos:space], name, data[nul + 1:nul + 21].hex()))
+                pos = nul + 21
+            self._trees[sha] = entries
+        return self._trees[sha]
+
+    def files(self, tree: str, prefix: str = '') -> Iterator[Tuple[str, str]]:
+        """(path, blob sha) for each regular file under a tree. Submodules and links are skipped."""
+        for mode, name, sha in self.tree(tree):
+            if mode == MODE_TREE:
+                yield from self.files(sha, f'{prefix}{name}/')
+            elif mode in MODE_FILES:
+                yield f'{prefix}{name}', sha
+
+def _root(path: Path) -> str:
+    return PurePosixPath(os.path.normpath(path).replace(os.sep, '/')).as_posix()
+
+def select(files: Dict[str, str], roots: Iterable[Path]) -> Dict[str, str]:
+    """The source files found under roots, like imports.find_source_files"""
+    prefixes = [_root(root) for root in roots]
+    return {
+        path: sha for path, sha in files.items()
+        if path.endswith('.py') and any(
+            prefix == '.' or path == prefix or path.startswith(prefix + '/') for prefix in prefixes
+        )
+    }
+
+@dataclass(frozen=True)
+class CommitResult:
+    commit: str
+    subject: str
+    # None if the commit can't be checked, and then a note saying why
+    warnings: Optional[Tuple[Warn, ...]]
+    note: Optional[str] = None
+
+class History:
+    """
+    Checks a project at each commit in a range of a repository's history.
+    Paths are relative to the root of the repository.
+    """
+    def __init__(self, repo: Path, analyzer: Optional[Analyzer] = None) -> None:
+        self.repo = repo
+        self.analyzer = analyzer or Analyzer()
+        # Blob sha -> imports found in it
+        self.blob_imports: Dict[str, Tuple[str, ...]] = {}
+        self.parsed = 0
+
+    def imports(self, objects: GitObjects, sha: str, path: str) -> Tuple[str, ...]:
+        if sha not in self.blob_imports:
+            self.parsed += 1
+            try:
+                found = tuple(parse_imports(objects.read(sha)[1]))
+            except (SyntaxError, ValueError) as e:
+                logger.warning(f"Can't parse {path} (blob {sha[:12]}): {e}")
+                found = ()
+            self.blob_imports[sha] = found
+        return self.blob_imports[sha]
+
+    def external_modules(self, objects: GitObjects, files: Dict[str, str]) -> List[str]:
+        return external_modules(itertools.chain.from_iterable(
+            self.imports(objects, sha, path) for path, sha in sorted(files.items())
+        ))
+
+    def check(
+        self, revisions: str, project_file: str, paths: Iterable[Path] = (),
+        *, tests: Optional[Iterable[Path]] = None,
+    ) -> Iterator[CommitResult]:
+        """Check each commit in revisions (such as A..B), oldest first"""
+        paths = list(paths)
+        tests = None if tests is None else list(tests)
+        commits = git(self.repo, 'rev-list', '--reverse', revisions, '--').split()
+        # The result only depends on the project file and the imports found,
+        # and those are often unchanged from one commit to the next.
+        last: Optional[Tuple[object, Tuple[Warn, ...]]] = None
+        with GitObjects(self.repo) as objects:
+            for commit in commits:
+                tree, subject = objects.commit(commit)
+                files = dict(objects.files(tree))
+                if project_file not in files:
+                    yield CommitResult(commit, subject, None, f"no {project_file}")
+                    continue
+                try:
+                    data = tomllib.loads(objects.read(files[project_file])[1].decode('utf8'))
+                    project = parse_poetry(data, Path(project_file))
+                except (ConfigError, ValueError, KeyError) as e:
+                    yield CommitResult(commit, subject, None, f"can't read {project_file}: {e}")
+                    continue
+                include, exclude = project.value.dependency_roots(paths, exclude=tests or ())
+                dependency_files = select(files, include)
+                for excluded in select(files, exclude):
+                    dependency_files.pop(excluded, None)
+                found = {
+                    DEPENDENCIES: self.external_modules(objects, dependency_files),
+                    DEV_DEPENDENCIES: self.external_modules(objects, select(files, project.value.dev_dependency_roots(tests))),
+                }
+                key = (files[project_file], found)
+                if last is None or last[0] != key:
+                    last = (key, self.analyzer.check_imports(project, found))
+                yield CommitResult(commit, subject, last[1])
+
+def toplevel(path: Path) -> Path:
+    """The root of the repository containing path"""
+    return Path(git(path, 'rev-parse', '--show-toplevel').strip())
+
+def repo_path(repo: Path, path: Path) -> str:
+    """A path as it appears in the repository"""
+    return Path(os.path.relpath(path.resolve(), repo.resolve())).as_posix()
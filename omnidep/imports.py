@@ -1,24 +1,38 @@
 
 import ast
+import functools
 import itertools
+import os
 from pathlib import Path
 import sys
-from typing import Iterable, List
+from typing import Callable, Iterable, Iterator, List, Union
 
 basic_types = (str, float, int, bytes, type(...))
 
-def iter_import_names(tree: ast.AST) -> Iterable[str]:
+# Reads the names imported by one source file.
+ReadImports = Callable[[Path], Iterable[str]]
+
+def import_names(node: Union[ast.Import, ast.ImportFrom]) -> Iterable[str]:
+    """
+    The full dotted names imported by one statement, other than by relative
+    imports. For "from X import Y", that's X.Y, since Y might be a submodule.
+    """
+    if isinstance(node, ast.Import):
+        # print(ast.unparse(node))
+        for alias in node.names:
+            yield alias.name
+    elif node.level == 0 and node.module is not None:
+        # print(ast.unparse(node))
+        for alias in node.names:
+            yield node.module if alias.name == '*' else f'{node.module}.{alias.name}'
+
+def iter_import_nodes(tree: ast.AST) -> Iterable[Union[ast.Import, ast.ImportFrom]]:
+    """Every import statement in tree, at any depth"""
     to_process: List[object] = [tree]
     while to_process:
         node = to_process.pop()
-        if isinstance(node, ast.ImportFrom):
-            # print(ast.unparse(node))
-            if node.level == 0 and node.module is not None:
-                yield node.module.partition('.')[0]
-        elif isinstance(node, ast.Import):
-            # print(ast.unparse(node))
-            for alias in node.names:
-                yield alias.name.partition('.')[0]
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            yield node
         elif node is None:
             pass
         elif isinstance(node, list):
@@ -28,18 +42,41 @@ def iter_import_names(tree: ast.AST) -> Iterable[str]:
         elif not isinstance(node, basic_types):
             raise NotImplementedError(f"unhandled {type(node)} {node!r}")
 
+def iter_import_names(tree: ast.AST) -> Iterable[str]:
+    for node in iter_import_nodes(tree):
+        yield from import_names(node)
+
 def find_source_files(path: Path) -> Iterable[Path]:
     if path.is_file() and path.suffix == '.py':
         return [path]
-    return path.glob('**/*.py')
+    return walk_source_files(path)
 
-def iter_modules(path: Path) -> Iterable[str]:
+def walk_source_files(root: Path) -> Iterator[Path]:
+    """
+    The .py files under root, like root.glob('**/*.py') but without pathlib's
+    set of every path it has yielded, so memory doesn't grow with the size of
+    the tree. As with pathlib, links to directories aren't followed.
+    """
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith('.py'):
+                yield Path(dirpath, name)
+
+def parse_imports(source: Union[str, bytes]) -> List[str]:
+    return list(iter_import_names(ast.parse(source)))
+
+def read_imports(file: Path) -> List[str]:
+    with file.open(encoding='utf8') as infile:
+        # print(file)
+        return parse_imports(infile.read())
+
+def iter_modules(path: Path, read: ReadImports = read_imports) -> Iterable[str]:
     for file in find_source_files(path):
-        with file.open(encoding='utf8') as infile:
-            # print(file)
-            tree = ast.parse(infile.read())
-            yield from iter_import_names(tree)
+        yield from read(file)
 
+# The answer for any given name never changes, and with isort it isn't cheap.
+# Bounded, since a process can check any number of projects.
+@functools.lru_cache(maxsize=8192)
 def is_external(module: str) -> bool:
     if module in ('setuptools', 'pkg_resources'):
         # Debateable: not technically part of Python, but distributed with it.
@@ -53,6 +90,12 @@ def is_external(module: str) -> bool:
         from isort import place_module
         return str(place_module(module)) not in ('STDLIB', 'FUTURE')
 
-def get_external_modules(paths: Iterable[Path]) -> List[str]:
-    all_modules = itertools.chain.from_iterable(map(iter_modules, paths))
-    return sorted(set(filter(is_external, all_modules)))
+def top_level(module: str) -> str:
+    return module.partition('.')[0]
+
+def external_modules(modules: Iterable[str]) -> List[str]:
+    return sorted(set(module for module in modules if is_external(top_level(module))))
+
+def get_external_modules(paths: Iterable[Path], read: ReadImports = read_imports) -> List[str]:
+    all_modules = itertools.chain.from_iterable(iter_modules(path, read) for path in paths)
+    return external_modules(all_modules)
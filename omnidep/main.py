@@ -1,13 +1,25 @@
 #!/usr/bin/env python3
 #
 
+from dataclasses import replace
 import logging
 from pathlib import Path
-from typing import Iterable, NoReturn, Optional
+import sys
+from typing import Iterable, Iterator, List, NoReturn, Optional, Sequence
 
-from .command import CommandLine
-from .errors import ConfigError
+from .analyzer import Analyzer
+from .archive import check_archive, is_archive
+from .command import (
+    BasicCommandLine, CommandLine, MergeCommandLine, WhichCommandLine,
+    parse_command_line,
+)
+from .errors import ConfigError, Warn
+from .history import CommitResult, History, repo_path, toplevel
+from .imports import is_external, top_level
+from .packages import which as find_providers
 from .project import read_poetry
+from .runcache import RunCache
+from .shard import find_imports, read_partials, write_partial
 
 logger = logging.getLogger()
 
@@ -21,12 +33,85 @@ def get_project_file(paths: Iterable[Path]) -> Optional[Path]:
     return None
 
 def main(args: CommandLine) -> int:
-    warnings = (
-        read_poetry(args.project or get_project_file(args.paths))
-        .collect(lambda x: x.check_dependencies(args.paths, exclude=args.tests or ()))
-        .collect(lambda x: x.check_dev_dependencies(args.tests))
-    ).warnings
+    project_file = args.project or get_project_file(args.paths)
+    analyzer = Analyzer(cache_dir=args.cache_dir, use_bytecode=args.use_bytecode, probe_imports=args.probe_imports)
+    if args.git_range is not None:
+        return report_history(check_history(args, args.git_range, project_file, analyzer))
+    archives = [path for path in args.paths if is_archive(path)]
+    if archives:
+        return report(check_archives(archives, args, analyzer))
+    if args.shard is not None:
+        if args.output is None:
+            raise SystemExit("ERROR: --shard requires --output")
+        project = read_poetry(project_file).value
+        root = project_file.parent if project_file else Path()
+        found = find_imports(project, args.paths, args.tests, shard=args.shard, root=root, read=analyzer.read_imports)
+        write_partial(args.output, args.shard, found)
+        logger.info(f"Wrote imports for shard {args.shard} to {args.output}")
+        return 0
+    if args.cache_dir is not None:
+        return report(RunCache(args.cache_dir).check(analyzer, project_file, args.paths, tests=args.tests))
+    return report(analyzer.check(project_file, args.paths, tests=args.tests))
 
+def check_archives(archives: List[Path], args: CommandLine, analyzer: Analyzer) -> List[Warn]:
+    others = [path for path in args.paths if path not in archives and path.name != 'pyproject.toml']
+    if others or args.tests or args.shard is not None:
+        raise SystemExit("ERROR: When checking wheels or sdists, only pyproject.toml can also be specified, without --tests or --shard")
+    project_file = args.project or get_project_file(args.paths)
+    warnings: List[Warn] = []
+    for archive in archives:
+        found = check_archive(archive, project_file, analyzer=analyzer)
+        if len(archives) > 1:
+            found = tuple(replace(warning, msg=f"{archive.name}: {warning.msg}") for warning in found)
+        warnings.extend(found)
+    return warnings
+
+def check_history(args: CommandLine, revisions: str, project_file: Optional[Path], analyzer: Analyzer) -> Iterable[CommitResult]:
+    if project_file is None or args.shard is not None or any(map(is_archive, args.paths)):
+        raise SystemExit("ERROR: --git-range requires pyproject.toml, and can't be used with --shard or archives")
+    repo = toplevel(project_file.parent.resolve())
+    paths = [Path(repo_path(repo, path)) for path in args.paths if path != project_file]
+    tests = None if args.tests is None else [Path(repo_path(repo, path)) for path in args.tests]
+    return History(repo, analyzer).check(revisions, repo_path(repo, project_file), paths, tests=tests)
+
+def merge(args: MergeCommandLine) -> int:
+    project_file = args.project or get_project_file(args.paths)
+    partials = [path for path in args.paths if path.name != 'pyproject.toml']
+    index = Analyzer(cache_dir=args.cache_dir).index
+    return report(read_partials(partials).check(read_poetry(project_file), index=index))
+
+def which_modules(names: Iterable[str]) -> Iterator[str]:
+    """Module names from the command line, with '-' meaning those on stdin"""
+    for name in names:
+        if name == '-':
+            yield from filter(None, (line.strip() for line in sys.stdin))
+        else:
+            yield name
+
+def which(args: WhichCommandLine) -> int:
+    """
+    Print one tab-separated line per provider of each module: the module,
+    the distribution, the rules by which it provides the module, and the part
+    of the module's name that it provides. Standard library modules are
+    provided by 'python'. Modules with no provider are printed with '-' for
+    the distribution and rule.
+    """
+    local_packages = read_poetry(args.project).value.local_packages if args.project else frozenset()
+    index = Analyzer(cache_dir=args.cache_dir).index
+    status = 0
+    for module in which_modules(args.modules):
+        if not is_external(top_level(module)):
+            print(module, 'python', 'stdlib', top_level(module), sep='\t')
+            continue
+        providers = find_providers(module, local_packages, index)
+        for provider in providers:
+            print(module, provider.distribution, ','.join(provider.rules) or '-', provider.module, sep='\t')
+        if not providers:
+            print(module, '-', '-', '-', sep='\t')
+            status = 1
+    return status
+
+def report(warnings: Sequence[Warn]) -> int:
     if warnings:
         print('\n'.join(w.report for w in warnings))
         print("See https://github.com/sjjessop/omnidep#error-codes-explained")
@@ -35,12 +120,45 @@ def main(args: CommandLine) -> int:
     logger.info("No issues found")
     return 0
 
+def report_history(results: Iterable[CommitResult]) -> int:
+    """
+    Print each commit, with the warnings that it adds (+) and removes (-).
+    The result is that of reporting the last commit.
+    """
+    previous: Sequence[Warn] = ()
+    for result in results:
+        print(f"{result.commit[:12]} {result.subject}")
+        if result.warnings is None:
+            print(f"    ({result.note})")
+            previous = ()
+            continue
+        for warning in result.warnings:
+            if warning not in previous:
+                print(f"  + {warning.report}")
+        for warning in previous:
+            if warning not in result.warnings:
+                print(f"  - {warning.report}")
+        previous = result.warnings
+    if previous:
+        print("See https://github.com/sjjessop/omnidep#error-codes-explained")
+        return 1
+    return 0
+
+def run(args: BasicCommandLine) -> int:
+    if isinstance(args, MergeCommandLine):
+        return merge(args)
+    if isinstance(args, WhichCommandLine):
+        return which(args)
+    if isinstance(args, CommandLine):
+        return main(args)
+    raise NotImplementedError(f"unhandled {type(args)}")
+
 def script_entry_point() -> NoReturn:
-    args = CommandLine.parse()
+    args = parse_command_line(sys.argv[1:])
     if args.log_level is not None:
         logging.basicConfig(level=args.log_level)
     try:
-        raise SystemExit(main(args))
+        raise SystemExit(run(args))
     except ConfigError as e:
         raise SystemExit(str(e)) from None
     finally:
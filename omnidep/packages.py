@@ -1,69 +1,510 @@
+from __future__ import annotations
 
+import ast
 import collections
 import contextlib
+from dataclasses import dataclass, field, replace
 import functools
+import hashlib
+import importlib.machinery
+import logging
+import mmap
+import os
 from pathlib import Path
 import re
+import struct
 import sys
-from typing import FrozenSet, List, Mapping, Optional
+from typing import (
+    Collection, Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence,
+    Set, Tuple,
+)
 
 if sys.version_info < (3, 8):
     import importlib_metadata as metadata
 else:
     from importlib import metadata
 
+from .compact import Buffer, CompactMap, LayeredMap
 from .errors import Violation as V
 from .errors import Warned, safe, unsafe
+from .imports import top_level
+
+logger = logging.getLogger()
 
 punctuation = re.compile(r'[\-._]+')
 
+# The name at the start of a requirement, per PEP 508
+requirement_name = re.compile(r'\s*([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)')
+extra_marker = re.compile(r';.*\bextra\s*==')
+# The modules imported by a line of a .pth file that site.py executes
+pth_import = re.compile(r'import[ \t]+([\w.]+(?:[ \t]*,[ \t]*[\w.]+)*)')
+
+# Change this whenever the content or layout of the persisted index changes.
+INDEX_FORMAT = 4
+INDEX_SECTIONS = 3
+
+# File names that can be imported as modules
+module_suffixes = (*importlib.machinery.all_suffixes(), '.pyi')
+INDEX_MAGIC = b'ODEPIDX\0'
+
+KNOWN_MODULES_FILE = Path(__file__).with_name('known_modules.txt')
+KNOWN_MODULES_HEADER = 'omnidep-known-modules 1'
+
+# The rules by which a module is found to be provided by a distribution. The
+# first three are from the distribution's metadata.
+RULE_TOP_LEVEL = 'top_level.txt'
+# A directory in the distribution's files, such as one containing __init__.py
+RULE_PACKAGE = 'package'
+# A single file in the distribution's files, such as X.py
+RULE_MODULE = 'module'
+# Under a directory that a .pth file in the distribution's files adds to
+# sys.path, as in some editable installs
+RULE_PTH = 'pth'
+# Mapped to its source by an import hook that a .pth file installs, as in other
+# editable installs (setuptools' MAPPING, or editables' map_module)
+RULE_FINDER = 'finder'
+# Not found in the distribution's files, but importing the module loads it
+# from one of them (see the probe module)
+RULE_PROBE = 'probe'
+# Not from any distribution: a directory on sys.path
+RULE_PATH = 'sys.path'
+# Not installed, but in omnidep's list of known modules
+RULE_KNOWN = 'known-modules'
+# Part of the project itself
+RULE_LOCAL = 'local'
+
+def requirement_names(requirements: Iterable[str], *, extras: bool = True) -> FrozenSet[str]:
+    """
+    Canonical names of the distributions in some requirements, such as the
+    values of Requires-Dist. Requirements that only apply when an extra is
+    selected are omitted unless extras is True.
+    """
+    names = set()
+    for requirement in requirements:
+        match = requirement_name.match(requirement)
+        if match and (extras or not extra_marker.search(requirement)):
+            names.add(canon(match.group(1)))
+    return frozenset(names)
+
+def source_modules(path: Path, name: str) -> Iterable[str]:
+    """
+    The dotted names of the module or package at path, imported as name, and
+    of all its parents, and of every package and module under it.
+    """
+    parts = name.split('.')
+    for depth in range(1, len(parts) + 1):
+        yield '.'.join(parts[:depth])
+    to_process = [(path, name)]
+    while to_process:
+        directory, package = to_process.pop()
+        with contextlib.suppress(OSError):
+            for entry in os.scandir(directory):
+                stem = entry.name.partition('.')[0]
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name.isidentifier() and entry.name != '__pycache__':
+                        yield f'{package}.{entry.name}'
+                        to_process.append((Path(entry.path), f'{package}.{entry.name}'))
+                elif entry.name.endswith(module_suffixes) and stem.isidentifier() and stem != '__init__':
+                    yield f'{package}.{stem}'
+
+def path_entry_modules(directory: Path) -> Iterable[str]:
+    """
+    The regular packages and modules at the top of a directory on sys.path,
+    and everything in them. Subdirectories without __init__.py are ignored,
+    since in a project's checkout they're usually not meant for import.
+    """
+    with contextlib.suppress(OSError):
+        for entry in os.scandir(directory):
+            path = Path(entry.path)
+            stem = entry.name.partition('.')[0]
+            if entry.is_dir():
+                if entry.name.isidentifier() and (path / '__init__.py').is_file():
+                    yield from source_modules(path, entry.name)
+            elif entry.name.endswith(module_suffixes) and stem.isidentifier():
+                yield stem
+
+def _literal(node: Optional[ast.AST]) -> object:
+    try:
+        return None if node is None else ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError, RecursionError):
+        return None
+
+def finder_mapping(file: Path) -> Dict[str, Path]:
+    """
+    Where the import hook in file says to find modules, read without running
+    it. This understands setuptools' editable finders, which have a dict
+    called MAPPING, and the editables package, which calls map_module.
+    """
+    try:
+        tree = ast.parse(file.read_bytes())
+    except (OSError, SyntaxError, ValueError):
+        return {}
+    found: List[Tuple[object, object]] = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            value = _literal(node.value)
+            if isinstance(value, dict) and any(isinstance(target, ast.Name) and target.id == 'MAPPING' for target in targets):
+                found.extend(value.items())
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'map_module':
+            if len(node.args) == 2:
+                found.append((_literal(node.args[0]), _literal(node.args[1])))
+    mapping = {}
+    for name, target in found:
+        if isinstance(name, str) and isinstance(target, str):
+            path = Path(target)
+            # editables maps packages to their __init__.py
+            mapping[name] = path.parent if path.name == '__init__.py' else path
+    return mapping
+
+def path_file_targets(pth: Path) -> Iterable[Tuple[str, Path]]:
+    """
+    What a .pth file makes importable, read the way site.py reads it, but
+    without running anything: ('', directory) for each directory it adds to
+    sys.path, and (name, path) for each module mapped by an import hook that
+    it imports.
+    """
+    try:
+        lines = pth.read_text(encoding='utf8').splitlines()
+    except (OSError, ValueError):
+        return
+    site_dir = pth.parent.resolve()
+    for line in lines:
+        if line.startswith('#') or not line.strip():
+            continue
+        match = pth_import.match(line)
+        if match:
+            for hook in match.group(1).split(','):
+                yield from finder_mapping(site_dir / f'{hook.strip()}.py').items()
+            continue
+        directory = (site_dir / line.rstrip()).resolve()
+        # A .pth file can add site-packages itself, which provides everything.
+        if directory != site_dir and directory.is_dir():
+            yield '', directory
+
+def path_file_modules(pth: Path) -> Iterable[Tuple[str, str]]:
+    """
+    The modules that a .pth file makes importable: both those in the
+    directories it adds to sys.path, and those mapped by its import hooks.
+    """
+    for name, path in path_file_targets(pth):
+        if name:
+            yield from ((module, RULE_FINDER) for module in source_modules(path, name))
+        else:
+            yield from ((module, RULE_PTH) for module in path_entry_modules(path))
+
+def distribution_modules(dist: metadata.Distribution) -> Iterable[Tuple[str, str]]:
+    """
+    Guess what modules a distribution provides: the names in top_level.txt,
+    and the dotted name of every package and module in its files, including
+    all their parents. Also, for editable installs, the modules found via
+    .pth files in its files. Yields (module, rule). Might contain duplicates.
+    """
+    for module in (dist.read_text('top_level.txt') or '').split():
+        yield module, RULE_TOP_LEVEL
+    for file in dist.files or ():
+        *parts, name = file.parts
+        if not parts and name.endswith('.pth'):
+            yield from path_file_modules(Path(str(dist.locate_file(file))))
+        if '__pycache__' in parts:
+            continue
+        rules = [RULE_PACKAGE] * len(parts)
+        if name.endswith(module_suffixes):
+            # Extension modules have suffixes like .cpython-311-darwin.so
+            stem = name.partition('.')[0]
+            if stem != '__init__':
+                parts.append(stem)
+                rules.append(RULE_MODULE)
+        path: List[str] = []
+        for part, rule in zip(parts, rules):
+            # Directories like foo-1.0.dist-info, or ../../bin, aren't modules
+            if not part.isidentifier():
+                break
+            path.append(part)
+            yield '.'.join(path), rule
+
+def source_tree_names(path: Path) -> Iterable[str]:
+    """
+    The names of the packages and modules that source_modules would find
+    under path, one string for each directory. Unlike their modification
+    times, these don't change when the same files are checked out again.
+    """
+    if not path.is_dir():
+        # A single module, mapped by an import hook
+        yield f'{path}\0{path.exists()}'
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(name for name in dirnames if name.isidentifier() and name != '__pycache__')
+        modules = sorted(name for name in filenames if name.endswith(module_suffixes))
+        yield '\0'.join([dirpath, *(f'{name}/' for name in dirnames), *modules])
+
+def environment_fingerprint() -> str:
+    """
+    A digest of the things that affect the DistributionIndex. It changes when
+    a distribution is installed, upgraded or removed, because that creates or
+    removes its metadata directory. For editable installs, it also changes
+    when modules are added to or removed from their source, found through
+    their .pth files.
+    """
+    digest = hashlib.sha256()
+    for item in (INDEX_FORMAT, sys.version, sys.byteorder, sys.path):
+        digest.update(repr(item).encode('utf8'))
+    for entry in sys.path:
+        # Not all entries are directories, or even exist.
+        with contextlib.suppress(OSError):
+            for found in sorted(os.scandir(entry or '.'), key=lambda x: x.name):
+                if found.name.endswith(('.dist-info', '.egg-info', '.egg-link', '.pth')):
+                    digest.update(f'{found.name}\0{found.stat().st_mtime_ns}\0'.encode())
+                if found.name.endswith('.pth'):
+                    for _, target in path_file_targets(Path(found.path)):
+                        for names in source_tree_names(target):
+                            digest.update(f'{names}\0'.encode('utf8', 'surrogateescape'))
+    return digest.hexdigest()
+
+@dataclass(frozen=True)
+class DistributionIndex:
+    """
+    What we know about the installed distributions, from one scan of their
+    metadata. Scanning is slow, so keep hold of the result for as long as the
+    environment doesn't change, or persist it with load().
+    """
+    # Dotted module name -> names of distributions that provide it, or
+    # provide anything under it. Because all parents of a name are present,
+    # this is a trie, flattened.
+    modules: Mapping[str, Sequence[str]]
+    # Canonical distribution name -> canonical names of the installed
+    # distributions that unconditionally require it
+    required_by: Mapping[str, Collection[str]] = field(default_factory=dict)
+    # Dotted module name -> "distribution rule" for each rule by which each
+    # distribution in modules was found to provide it
+    rules: Mapping[str, Collection[str]] = field(default_factory=dict)
+
+    # In Python 3.10+, there is metadata.packages_distributions, but all it
+    # checks is top_level.txt, so we still need to search for files as well.
+    @classmethod
+    def scan(cls) -> DistributionIndex:
+        pkg_to_dist = collections.defaultdict(set)
+        required_by = collections.defaultdict(set)
+        rules = collections.defaultdict(set)
+        for dist in metadata.distributions():
+            dist_name = dist.metadata['Name']
+            for module, rule in distribution_modules(dist):
+                # top_level.txt isn't always tidy
+                if all(map(str.isidentifier, module.split('.'))):
+                    pkg_to_dist[module].add(dist_name)
+                    rules[module].add(f'{dist_name} {rule}')
+            for requirement in requirement_names(dist.requires or (), extras=False):
+                required_by[requirement].add(canon(dist_name))
+        return cls(
+            modules=CompactMap.build(pkg_to_dist),
+            required_by=CompactMap.build(required_by),
+            rules=CompactMap.build(rules),
+        )
+
+    def resolve(self, module: str) -> Tuple[str, Sequence[str]]:
+        """
+        Find the deepest part of a dotted module name that's provided by any
+        distribution, and the distributions that provide it. For example in
+        a namespace package X, part X.Y might be provided by fewer
+        distributions than X is. Returns ('', ()) if nothing is found.
+        """
+        found: Tuple[str, Sequence[str]] = ('', ())
+        if isinstance(self.modules, CompactMap):
+            # The last one is the deepest
+            for deeper in self.modules.walk(module):
+                found = deeper
+            return found
+        parts = module.split('.')
+        for depth in range(1, len(parts) + 1):
+            prefix = '.'.join(parts[:depth])
+            dists = self.modules.get(prefix)
+            if dists is None:
+                break
+            found = (prefix, dists)
+        return found
+
+    def with_modules(self, extra: Mapping[str, Collection[str]], rule: str) -> DistributionIndex:
+        """
+        This index, plus the distributions in extra that provide each module
+        by rule. They're layered over this index rather than copying it, so
+        this is quick for a few modules however big the index is.
+        """
+        modules: Dict[str, Set[str]] = collections.defaultdict(set)
+        rules: Dict[str, Set[str]] = collections.defaultdict(set)
+        for module, dists in extra.items():
+            parts = module.split('.')
+            for depth in range(1, len(parts) + 1):
+                modules['.'.join(parts[:depth])].update(dists)
+            rules[module].update(f'{dist} {rule}' for dist in dists)
+        return replace(self, modules=LayeredMap(self.modules, modules), rules=LayeredMap(self.rules, rules))
+
+    def to_bytes(self) -> bytes:
+        sections = [CompactMap.to_bytes(mapping) for mapping in (self.modules, self.required_by, self.rules)]
+        header = struct.pack(f'=8sII{len(sections)}I', INDEX_MAGIC, INDEX_FORMAT, len(sections), *map(len, sections))
+        return b''.join([header, *sections])
+
+    @classmethod
+    def from_buffer(cls, buffer: Buffer) -> DistributionIndex:
+        """
+        Read an index written by to_bytes. The index refers to the buffer
+        rather than copying it, so it can be an mmap of a file.
+        """
+        view = memoryview(buffer)
+        try:
+            magic, version, count = struct.unpack_from('=8sII', view)
+            if magic != INDEX_MAGIC or version != INDEX_FORMAT or count != INDEX_SECTIONS:
+                raise ValueError("not a distribution index from this version of omnidep")
+            sizes = struct.unpack_from(f'={count}I', view, 16)
+        except struct.error:
+            raise ValueError("distribution index is truncated") from None
+        pos = 16 + 4 * count
+        sections = []
+        for size in sizes:
+            sections.append(CompactMap(view[pos:pos + size]))
+            pos += size
+        return cls(modules=sections[0], required_by=sections[1], rules=sections[2])
+
+    @classmethod
+    def load(cls, cache_dir: Path) -> DistributionIndex:
+        """
+        Load the index for the current environment from cache_dir, if it was
+        written there before. Otherwise scan, and write it for next time.
+        """
+        path = cache_dir / f'index-{environment_fingerprint()[:32]}.bin'
+        with contextlib.suppress(OSError, ValueError):
+            with path.open('rb') as infile:
+                mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            return cls.from_buffer(mapped)
+        index = cls.scan()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        temp.write_bytes(index.to_bytes())
+        try:
+            temp.replace(path)
+        except OSError as e:
+            # On Windows, another process might have the file mapped. Then
+            # it's already there, and that process's copy is as good as ours.
+            logger.info(f"Keeping the existing {path}: {e}")
+            with contextlib.suppress(OSError):
+                temp.unlink()
+        # Indexes for other environments are most likely out of date.
+        for old in cache_dir.glob('index-*.bin'):
+            if old != path:
+                with contextlib.suppress(OSError):
+                    old.unlink()
+        return index
+
 # In Python 3.9+, should use functools.cache instead of lru_cache
-# In Python 3.10+, there is metadata.packages_distributions, but all it checks
-# is top_level.txt, so we still need to search for files as well.
 @functools.lru_cache()
-def packages_distributions() -> Mapping[str, List[str]]:
-    pkg_to_dist = collections.defaultdict(set)
-    for dist in metadata.distributions():
-        dist_name = dist.metadata['Name']
-        def add_to(pkg: str) -> None:
-            pkg_to_dist[pkg].add(dist_name)
-        for toplevel in (dist.read_text('top_level.txt') or '').split():
-            add_to(toplevel)
-        for file in dist.files or ():
-            # TODO - maybe the package could contain .pyc or .pyd but no .py
-            if file.name == '__init__.py':
-                add_to(str(file.parent))
-            elif str(file.parent) == '.' and file.suffix == '.py':
-                add_to(file.stem)
-            else:
-                add_to(file.parts[0])
-    # TODO - make the return immutable, since it's cached
-    return {key: sorted(value) for key, value in pkg_to_dist.items()}
-
-def find_packages(module: str, local_packages: FrozenSet[str]) -> Warned[List[str]]:
-    """
-    Given a top-level code module, which installed package(s) provide it?
-    This is a difficult question because Python packaging doesn't try to fully
-    answer it, hence we need to apply some guesswork.
-    """
-    if canon(module) in local_packages:
-        return safe([module])
-    # TODO - Perhaps a more sure way would be to import the module and then
-    # look for __file__ in all the packages.files
-    #
+def current_index() -> DistributionIndex:
+    return DistributionIndex.scan()
+
+def packages_distributions() -> Mapping[str, Sequence[str]]:
+    return current_index().modules
+
+@functools.lru_cache()
+def known_modules() -> Dict[str, str]:
+    """
+    omnidep's own list of the distributions that provide some common modules,
+    for use when they aren't installed. Module name -> distribution name.
+    """
+    with KNOWN_MODULES_FILE.open(encoding='utf8') as infile:
+        lines = [line.strip() for line in infile if line.strip() and not line.startswith('#')]
+    if not lines or lines[0] != KNOWN_MODULES_HEADER:
+        raise ValueError(f"{KNOWN_MODULES_FILE} is not in a supported format")
+    known = {}
+    for line in lines[1:]:
+        parts = line.split()
+        if len(parts) != 2:
+            raise ValueError(f"{KNOWN_MODULES_FILE}: expected 'module distribution', got {line!r}")
+        known[parts[0]] = parts[1]
+    return known
+
+def known_distribution(module: str) -> Tuple[str, Optional[str]]:
+    """
+    The deepest part of a dotted module name in known_modules, and the
+    distribution that provides it. ('', None) if there isn't one.
+    """
+    known = known_modules()
+    parts = module.split('.')
+    for depth in range(len(parts), 0, -1):
+        prefix = '.'.join(parts[:depth])
+        if prefix in known:
+            return prefix, known[prefix]
+    return '', None
+
+def import_key(module: str, local_packages: FrozenSet[str], index: Optional[DistributionIndex] = None) -> str:
+    """
+    The part of a dotted module name that determines what provides it: the
+    deepest part that's in the index, or else in known_modules, or else the
+    top-level name.
+    """
+    top = top_level(module)
+    if canon(top) in local_packages:
+        return top
+    return (index or current_index()).resolve(module)[0] or known_distribution(module)[0] or top
+
+@dataclass(frozen=True)
+class Provider:
+    """
+    Something that provides a module: a distribution (or local package or
+    directory), the part of the module's dotted name that it provides, and the
+    rules by which that was found.
+    """
+    distribution: str
+    module: str
+    rules: Tuple[str, ...]
+
+def which(
+    module: str, local_packages: FrozenSet[str] = frozenset(), index: Optional[DistributionIndex] = None,
+) -> List[Provider]:
+    """
+    Given a code module, what provides it? This is a difficult question because
+    Python packaging doesn't try to fully answer it, hence we need to apply
+    some guesswork, and this says which guess was used.
+    """
+    top = top_level(module)
+    if canon(top) in local_packages:
+        return [Provider(top, top, (RULE_LOCAL,))]
     # If a package lists our module in its top-level.txt or sources, it will
-    # appear here.
-    package = packages_distributions().get(module)
-    if package is not None:
-        return safe(list(package))
+    # appear here. Importing the module and looking for its __file__ in the
+    # packages' files is more sure, but runs its code, so that's only done
+    # with --probe-imports (see probe.py), and the answers are in the index.
+    index = index or current_index()
+    prefix, package = index.resolve(module)
+    if package:
+        rules = collections.defaultdict(list)
+        for entry in index.rules.get(prefix, ()):
+            name, _, rule = entry.rpartition(' ')
+            rules[name].append(rule)
+        return [Provider(name, prefix, tuple(rules[name])) for name in package]
     # Maybe the package is on the path, in which case no package dependency is
     # needed provided that it remains available on the path.
-    if any((Path(path) / module).is_dir() for path in sys.path):
-        return unsafe(
-            [module],
-            V.ODEP008(f"Module {module!r} not under package management but found on python path")
-        )
-    return safe([])
+    if any((Path(path) / top).is_dir() for path in sys.path):
+        return [Provider(top, top, (RULE_PATH,))]
+    # As a last resort, guess.
+    known, dist = known_distribution(module)
+    if dist is not None:
+        return [Provider(dist, known, (RULE_KNOWN,))]
+    return []
+
+def is_guess(providers: Sequence[Provider]) -> bool:
+    """Whether providers from which() are only a guess, from omnidep's list of known modules"""
+    return len(providers) == 1 and providers[0].rules == (RULE_KNOWN,)
+
+def find_packages(
+    module: str, local_packages: FrozenSet[str], index: Optional[DistributionIndex] = None,
+) -> Warned[List[str]]:
+    """Given a code module, which installed package(s) provide it?"""
+    return provided_by(which(module, local_packages, index))
+
+def provided_by(providers: Sequence[Provider]) -> Warned[List[str]]:
+    """The distributions from which(), warning if they're not managed"""
+    found = [provider.distribution for provider in providers]
+    if len(providers) == 1 and providers[0].rules == (RULE_PATH,):
+        return unsafe(found, V.ODEP008(f"Module {found[0]!r} not under package management but found on python path"))
+    if is_guess(providers):
+        logger.warning(f"Module {providers[0].module!r} is not installed: assuming it is provided by {found[0]!r}, according to omnidep's list of known modules")
+    return safe(found)
 
 def canon(package_name: str) -> str:
     """
@@ -0,0 +1,190 @@
+"""
+Finding what provides a module by importing it and looking at its __file__,
+for modules that the distributions' metadata doesn't account for. This runs
+third-party code, so it's opt-in, and each module is imported in a separate
+subprocess with limits on its time and memory. omnidep itself never imports
+the module, and one that hangs or misbehaves only loses its own answer.
+
+Answers are cached by environment fingerprint, since they only change when
+something is installed or removed.
+"""
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import functools
+import json
+import logging
+import os
+from pathlib import Path
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional
+
+if sys.version_info < (3, 8):
+    import importlib_metadata as metadata
+else:
+    from importlib import metadata
+
+from .packages import environment_fingerprint, module_suffixes
+
+logger = logging.getLogger()
+
+PROBE_VERSION = 1
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MEMORY = 2 << 30
+
+# Run by "python -c" with the arguments: module name, memory limit in bytes
+# (0 for none), and sys.path as JSON. Anything the module prints goes to
+# stderr, and only the JSON answer to stdout.
+PROBE_SCRIPT = '''\
+import importlib, json, os, sys
+name, memory, path = sys.argv[1], int(sys.argv[2]), json.loads(sys.argv[3])
+if memory:
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    except (ImportError, ValueError, OSError):
+        pass
+out = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+sys.path[:] = path
+importlib.import_module(name)
+parts = name.split(".")
+for depth in range(len(parts), 0, -1):
+    file = getattr(sys.modules.get(".".join(parts[:depth])), "__file__", None)
+    if file:
+        break
+out.write(json.dumps(file))
+out.flush()
+'''
+
+class ProbeError(Exception):
+    """An import probe failed, which might not happen next time"""
+
+def probe_file(module: str, *, timeout: float = DEFAULT_TIMEOUT, memory: int = DEFAULT_MEMORY) -> Optional[str]:
+    """
+    The file that module (or failing that, its deepest parent) is loaded
+    from, found by importing it in a subprocess, or None if it has no file.
+    Raises ProbeError if it can't be imported, whether because it doesn't
+    exist, it raises, or it runs out of memory, and subprocess.TimeoutExpired
+    if it takes longer than timeout seconds.
+    """
+    args = [sys.executable, '-E', '-B', '-c', PROBE_SCRIPT, module, str(memory), json.dumps(sys.path)]
+    # Started in a new session, to kill anything the module starts too. Run in
+    # an empty directory, in case the module writes files where it's run.
+    with tempfile.TemporaryDirectory() as cwd, subprocess.Popen(
+        args, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,  # noqa: S603: our own script
+        start_new_session=True,
+    ) as proc:
+        try:
+            out, _ = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_session(proc)
+            raise
+    if proc.returncode != 0:
+        raise ProbeError(f"importing {module!r} failed with exit status {proc.returncode}")
+    try:
+        file = json.loads(out)
+    except ValueError:
+        raise ProbeError(f"importing {module!r} gave unexpected output {out[:100]!r}") from None
+    return file if isinstance(file, str) else None
+
+def kill_session(proc: subprocess.Popen[bytes]) -> None:
+    if hasattr(os, 'killpg'):
+        with contextlib.suppress(OSError):
+            os.killpg(proc.pid, signal.SIGKILL)
+    proc.kill()
+    proc.wait()
+
+def _real(path: str) -> str:
+    return os.path.normcase(os.path.realpath(path))
+
+@functools.lru_cache(maxsize=None)
+def file_distributions() -> Dict[str, List[str]]:
+    """The installed module files, and the names of the distributions that list them"""
+    found: Dict[str, List[str]] = {}
+    for dist in metadata.distributions():
+        name = dist.metadata['Name']
+        for file in dist.files or ():
+            if file.name.endswith(module_suffixes):
+                found.setdefault(_real(str(dist.locate_file(file))), []).append(name)
+    return found
+
+class Prober:
+    """
+    Imports modules in a pool of up to jobs subprocesses at a time, to find
+    what provides them. Answers are kept in cache_dir, if specified.
+    """
+    def __init__(
+        self, *, cache_dir: Optional[Path] = None, jobs: Optional[int] = None,
+        timeout: float = DEFAULT_TIMEOUT, memory: int = DEFAULT_MEMORY,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.jobs = jobs or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory = memory
+        self._answers: Optional[Dict[str, List[str]]] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def path(cache_dir: Path) -> Path:
+        return cache_dir / f'probe-{environment_fingerprint()[:32]}.json'
+
+    def _load(self) -> Dict[str, List[str]]:
+        if self._answers is None:
+            self._answers = {}
+            if self.cache_dir is not None:
+                with contextlib.suppress(OSError, ValueError):
+                    data = json.loads(self.path(self.cache_dir).read_text(encoding='utf8'))
+                    if data.get('omnidep-probe') == PROBE_VERSION:
+                        self._answers = dict(data['answers'])
+        return self._answers
+
+    def _save(self) -> None:
+        if self.cache_dir is None:
+            return
+        path = self.path(self.cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        temp.write_text(json.dumps({'omnidep-probe': PROBE_VERSION, 'answers': self._answers}), encoding='utf8')
+        temp.replace(path)
+
+    def probe(self, module: str) -> Optional[List[str]]:
+        """Distributions providing module, or None if the probe failed"""
+        try:
+            file = probe_file(module, timeout=self.timeout, memory=self.memory)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Import probe for {module!r} timed out after {self.timeout}s")
+            return None
+        except ProbeError as e:
+            logger.info(f"Import probe failed: {e}")
+            return None
+        if file is None:
+            return []
+        return file_distributions().get(_real(file), [])
+
+    def distributions(self, modules: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Distributions providing each module, probing any not already known. A
+        module that couldn't be imported, or was timed out, has none, and is
+        probed again next time.
+        """
+        # Locked, so that threads sharing a Prober don't probe the same module.
+        with self._lock:
+            answers = self._load()
+            modules = sorted(set(modules))
+            todo = [module for module in modules if module not in answers]
+            if todo:
+                logger.info(f"Probing imports: {todo}")
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                    for module, found in zip(todo, pool.map(self.probe, todo)):
+                        # Failures and timeouts might not happen next time, so
+                        # aren't kept.
+                        if found is not None:
+                            answers[module] = found
+                self._save()
+            return {module: answers.get(module, []) for module in modules}
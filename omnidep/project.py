@@ -1,14 +1,14 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import itertools
 import logging
 from pathlib import Path
 import sys
 from typing import (
-    Any, Collection, Container, Dict, FrozenSet, Iterable, Optional, Set,
-    Tuple,
+    Any, Collection, Container, Dict, FrozenSet, Iterable, Iterator, List,
+    Mapping, Optional, Sequence, Set, Tuple,
 )
 
 if sys.version_info >= (3, 11):
@@ -20,7 +20,10 @@ from .command import Config
 from .errors import Violation as V
 from .errors import Warn, Warned, safe, unsafe
 from .imports import find_source_files, get_external_modules
-from .packages import canon, find_packages, get_preferred_name
+from .packages import (
+    DistributionIndex, Provider, canon, current_index, get_preferred_name,
+    import_key, is_guess, provided_by, which,
+)
 
 logger = logging.getLogger()
 
@@ -36,6 +39,27 @@ def check_order(deps: Collection[str], label: str = 'dependencies') -> Iterable[
             yield V.ODEP006(f"{label} are not sorted: {first!r} before {second!r}")
             return
 
+def is_under(file: Path, root: Path) -> bool:
+    """Whether find_source_files(root) would find file"""
+    return file == root or root in file.parents
+
+def find_files(paths: Iterable[Path], exclude: Iterable[Path] = ()) -> Iterator[Path]:
+    """
+    The source files under paths but not under exclude, each once. They're
+    found as they're needed, without holding the whole tree in memory, so a
+    file found under more than one path is recognised by where it is, not by
+    remembering it.
+    """
+    paths = list(paths)
+    exclude = list(exclude)
+    logger.info(f"searching {', '.join(map(str, paths))}")
+    for idx, path in enumerate(paths):
+        # Files under an earlier path were found there.
+        skip = [*exclude, *paths[:idx]]
+        for file in find_source_files(path):
+            if not any(is_under(file, root) for root in skip):
+                yield file
+
 def fix_canonical_names(data: Dict[str, Any]) -> Warned[FrozenSet[str]]:
     def check_canon(package_name: str) -> Warned[str]:
         canonical_name = canon(package_name)
@@ -59,60 +83,121 @@ class Project:
     config: Config
     local_packages: FrozenSet[str] = frozenset()
     extra_paths: Tuple[Path, ...] = ()
+    # child-packages config, inverted: child -> parents that provide it
+    parents: Mapping[str, FrozenSet[str]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        parents: Dict[str, Set[str]] = {}
+        for parent, children in self.config.child_packages.items():
+            for child in children:
+                parents.setdefault(child, set()).add(parent)
+        inverted = {child: frozenset(values) for child, values in parents.items()}
+        object.__setattr__(self, 'parents', inverted)
+
+    def dependency_roots(
+        self, paths: Iterable[Path],
+        *, exclude: Iterable[Path] = (),
+    ) -> Tuple[List[Path], List[Path]]:
+        """Where to search for dependency_files, and where not to"""
+        return [*paths, *self.extra_paths], [*exclude, *self.config.local_test_paths]
+
+    def dev_dependency_roots(self, paths: Optional[Iterable[Path]]) -> List[Path]:
+        """Where to search for dev_dependency_files"""
+        return [*(paths or ()), *self.config.local_test_paths]
+
+    def dependency_files(
+        self, paths: Iterable[Path],
+        *, exclude: Iterable[Path] = (),
+    ) -> Iterator[Path]:
+        """Source files whose imports must be provided by dependencies"""
+        include, exclude = self.dependency_roots(paths, exclude=exclude)
+        return find_files(include, exclude=exclude)
+
+    def dev_dependency_files(self, paths: Optional[Iterable[Path]]) -> Iterator[Path]:
+        """Source files whose imports may be provided by dev-dependencies"""
+        return find_files(self.dev_dependency_roots(paths))
 
     def check_dependencies(
         self, paths: Iterable[Path],
         *, exclude: Iterable[Path] = (),
     ) -> Iterable[Warn]:
-        yield from self.check_modules(
-            itertools.chain(paths, self.extra_paths),
+        files = self.dependency_files(paths, exclude=exclude)
+        yield from self.check_dependency_imports(get_external_modules(files))
+
+    def check_dev_dependencies(self, paths: Optional[Iterable[Path]]) -> Iterable[Warn]:
+        files = self.dev_dependency_files(paths)
+        yield from self.check_dev_dependency_imports(get_external_modules(files))
+
+    def check_dependency_imports(
+        self, modules: Iterable[str],
+        *, index: Optional[DistributionIndex] = None, check_unused: bool = True,
+    ) -> Iterable[Warn]:
+        yield from self.check_imports(
+            modules,
             self.dependencies,
             self.local_packages,
-            exclude=itertools.chain(exclude, self.config.local_test_paths),
+            check_unused=check_unused,
+            index=index,
         )
 
-    def check_dev_dependencies(self, paths: Optional[Iterable[Path]]) -> Iterable[Warn]:
-        yield from self.check_modules(
-            itertools.chain(paths or (), self.config.local_test_paths),
+    def check_dev_dependency_imports(
+        self, modules: Iterable[str],
+        *, index: Optional[DistributionIndex] = None,
+    ) -> Iterable[Warn]:
+        yield from self.check_imports(
+            modules,
             self.dev_dependencies,
             self.local_packages | set(self.config.local_test_packages),
             label='dev-dependencies',
             # Because dev-dependencies includes linters etc. that aren't used
             # anywhere in the code.
             check_unused=False,
+            index=index,
         )
 
     def check_modules(
         self, paths: Iterable[Path], packages: Collection[str], local_packages: FrozenSet[str],
         *, label: str = 'dependencies', check_unused: bool = True, exclude: Iterable[Path] = (),
     ) -> Iterable[Warn]:
-        paths = list(paths)
-        logger.info(f"searching {', '.join(map(str, paths))}")
-        def get_files(paths: Iterable[Path]) -> Set[Path]:
-            return set(itertools.chain.from_iterable(map(find_source_files, paths)))
-        included_paths = get_files(paths) - get_files(exclude)
-        modules = [
-            module for module in get_external_modules(included_paths)
-            if not self.ignore_import(module)
-        ]
+        modules = get_external_modules(find_files(paths, exclude))
+        yield from self.check_imports(
+            modules, packages, local_packages, label=label, check_unused=check_unused,
+        )
+
+    def check_imports(
+        self, modules: Iterable[str], packages: Collection[str], local_packages: FrozenSet[str],
+        *, label: str = 'dependencies', check_unused: bool = True,
+        index: Optional[DistributionIndex] = None,
+    ) -> Iterable[Warn]:
+        """
+        Check the external modules imported by some code against the packages
+        it's allowed to use.
+        """
+        # Many imports can come down to the same question, like X.Y and X.Z
+        # when only one distribution provides X.
+        modules = sorted(set(
+            import_key(module, local_packages, index)
+            for module in modules if not self.ignore_import(module)
+        ))
         logger.info(f"{label} imported: {modules}")
         used: Set[str] = {'python'}
         for module in modules:
-            founds = find_packages(module, local_packages)
+            providers = which(module, local_packages, index)
+            founds = provided_by(providers)
             yield from founds.warnings
             found = list(map(canon, founds.value))
             if len(found) == 1:
                 package = found[0]
                 used.add(package)
-                if package not in local_packages and not self.required(package, packages):
-                    yield V.ODEP001(f"Package {package!r} is imported but not listed in {label}", package)
+                if package not in local_packages and not self.required(package, packages, index):
+                    yield self.missing(module, package, packages, providers, label=label, index=index)
             elif len(found) == 0:
                 yield V.ODEP002(f"Module {module!r} is imported but not installed, so I don't know what package is needed", module)
             else:
                 # Namespace package - implemented across multiple installed
                 # packages. So for any given import, we don't know which
                 # package supplies that part of the namespace package.
-                options = [pkg in local_packages or self.required(pkg, packages) for pkg in found]
+                options = [pkg in local_packages or self.required(pkg, packages, index) for pkg in found]
                 if all(options):
                     # OK, if we depend on them all that's fine
                     used.update(found)
@@ -126,25 +211,65 @@ class Project:
             if unused:
                 yield V.ODEP005(f"Unused {label} in project file: {sorted(unused)}")
 
+    def missing(
+        self, module: str, package: str, packages: Container[str], providers: Sequence[Provider],
+        *, label: str, index: Optional[DistributionIndex],
+    ) -> Warn:
+        """ODEP001 for a package that provides module, but isn't in packages"""
+        msg = f"Package {package!r} is imported but not listed in {label}"
+        parents = self.requiring_parents(package, packages, index)
+        if parents:
+            msg += f" (it is required by {parents}: consider child-packages)"
+        if is_guess(providers):
+            msg += f" (guessed: {module!r} isn't installed, and omnidep's built-in list of modules says {package!r} provides it)"
+        return V.ODEP001(msg, package)
+
     def ignore_import(self, module: str) -> bool:
-        return bool(self.config) and module in self.config.ignore_imports
+        return bool(self.config) and any(
+            module == ignored or module.startswith(ignored + '.')
+            for ignored in self.config.ignore_imports
+        )
 
-    def required(self, package: str, packages: Container[str]) -> bool:
+    def required(
+        self, package: str, packages: Container[str],
+        index: Optional[DistributionIndex] = None,
+    ) -> bool:
         def mentioned(pkg: str) -> bool:
             return pkg in packages or pkg in self.local_packages
         if mentioned(package):
             return True
-        for parent, children in self.config.child_packages.items():
-            if package in children and mentioned(parent):
-                return True
+        if any(map(mentioned, self.parents.get(package, ()))):
+            return True
+        if self.config.infer_child_packages:
+            return bool(self.requiring_parents(package, packages, index))
         return False
 
+    def requiring_parents(
+        self, package: str, packages: Container[str],
+        index: Optional[DistributionIndex] = None,
+    ) -> List[str]:
+        """
+        Which of the project's dependencies require package, according to their
+        installed metadata?
+        """
+        required_by = (index or current_index()).required_by.get(package, ())
+        return sorted(parent for parent in required_by if parent in packages)
+
 def read_poetry(toml_file: Optional[Path]) -> Warned[Project]:
     if toml_file is None:
         logger.error("pyproject.toml not specified")
         return safe(Project((), (), Config.make()))
     with toml_file.open('rb') as infile:
-        tools = tomllib.load(infile)['tool']
+        data = tomllib.load(infile)
+    return parse_poetry(data, toml_file)
+
+def parse_poetry(data: Dict[str, Any], toml_file: Optional[Path] = None) -> Warned[Project]:
+    """
+    Like read_poetry, for a pyproject.toml that has already been loaded. Paths
+    in the project are relative to the directory containing toml_file, or if
+    it's None, then they're relative to the root of the project.
+    """
+    tools = data['tool']
     poetry_data = tools['poetry']
     config = Config.make(tools.get('omnidep'), toml_file)
 
@@ -178,6 +303,6 @@ def read_poetry(toml_file: Optional[Path]) -> Warned[Project]:
         dev_dependencies=deps.value | dev_deps.value,
         config=config,
         local_packages=frozenset(map(canon, pkgs)),
-        extra_paths=tuple(toml_file.parent / pack for pack in pkgs),
+        extra_paths=tuple((toml_file.parent if toml_file else Path()) / pack for pack in pkgs),
     )
     return Warned.gather([deps, dev_deps]).set(project)
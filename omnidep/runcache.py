@@ -0,0 +1,223 @@
+"""
+Reusing the result of an earlier run with the same arguments, as far as
+nothing it depends on has changed.
+
+If the environment, the project file, and the source files are all unchanged,
+then the earlier warnings are returned without doing anything else. If only
+the project file (or environment) changed, and not where the project's source
+files are, then the imports found last time are checked against it, without
+searching for or reading any source files.
+
+Source files are judged unchanged the way git does it: first by modification
+time and size, and if those differ then by content. So a fresh checkout of
+the same code, as in CI, is still unchanged.
+"""
+from __future__ import annotations
+
+import contextlib
+from dataclasses import asdict, dataclass, field, replace
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .analyzer import Analyzer
+from .errors import Violation, Warn
+from .packages import environment_fingerprint
+from .project import Project, read_poetry
+from .shard import DEPENDENCIES, DEV_DEPENDENCIES
+
+logger = logging.getLogger()
+
+RUN_VERSION = 1
+
+# A file modified this soon before a run might be modified again within the
+# resolution of its timestamp, so its timestamp is not trusted next time.
+RACY_NS = 2 * 10**9
+
+# Where a run searched for source files: label -> [included, excluded].
+Roots = Dict[str, List[List[str]]]
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()  # noqa: S324: not security
+
+def _file_digest(path: Path) -> str:
+    return _digest(path.read_bytes())
+
+def _dir_digest(path: str) -> str:
+    """Digest of the entries in a directory that can contain source files"""
+    names = sorted(
+        entry.name + ('/' if entry.is_dir() else '')
+        for entry in os.scandir(path)
+        if entry.is_dir() or entry.name.endswith('.py')
+    )
+    return _digest('\0'.join(names).encode('utf8', 'surrogateescape'))
+
+def _stamp(stat: os.stat_result, started: int) -> Optional[int]:
+    return None if stat.st_mtime_ns >= started - RACY_NS else stat.st_mtime_ns
+
+def code_fingerprint(here: Path = Path(__file__).parent) -> str:
+    """
+    A digest of omnidep's own code, and data files such as the list of known
+    modules, which can change the results too
+    """
+    stamps = sorted(
+        (path.name, path.stat().st_mtime_ns, path.stat().st_size)
+        for path in here.iterdir() if path.is_file()
+    )
+    return _digest(repr(stamps).encode('utf8'))
+
+@dataclass
+class Tree:
+    """
+    Every directory and .py file under some paths, with their modification
+    times and digests. A time of None means "check the digest".
+    """
+    # path -> [mtime_ns, size, digest of contents]
+    files: Dict[str, List[Any]] = field(default_factory=dict)
+    # path -> [mtime_ns, digest of names of subdirectories and .py files]
+    dirs: Dict[str, List[Any]] = field(default_factory=dict)
+    # Paths that were searched but didn't exist
+    missing: List[str] = field(default_factory=list)
+
+    @classmethod
+    def scan(cls, roots: Iterable[Path], started: int) -> Tree:
+        """
+        Record everything that find_source_files would find, and the
+        directories it would search. started is time.time_ns() at the start
+        of the run.
+        """
+        tree = cls()
+        def add_file(path: Path) -> None:
+            stat = path.stat()
+            tree.files[str(path)] = [_stamp(stat, started), stat.st_size, _file_digest(path)]
+        for root in roots:
+            if root.is_file():
+                add_file(root)
+                continue
+            if not root.is_dir():
+                tree.missing.append(str(root))
+                continue
+            # Links to directories aren't followed, as in find_source_files.
+            for dirpath, _, filenames in os.walk(root):
+                tree.dirs[dirpath] = [_stamp(Path(dirpath).stat(), started), _dir_digest(dirpath)]
+                for name in filenames:
+                    if name.endswith('.py'):
+                        add_file(Path(dirpath, name))
+        return tree
+
+    def refresh(self, started: int) -> Optional[Tree]:
+        """
+        If nothing has changed, return this tree with the current times (to
+        make the next check quicker). Otherwise None.
+        """
+        refreshed = Tree(missing=self.missing)
+        try:
+            if any(os.path.lexists(path) for path in self.missing):
+                return None
+            for path, (mtime, digest) in self.dirs.items():
+                stat = Path(path).stat()
+                if stat.st_mtime_ns != mtime and _dir_digest(path) != digest:
+                    return None
+                refreshed.dirs[path] = [_stamp(stat, started), digest]
+            for path, (mtime, size, digest) in self.files.items():
+                stat = Path(path).stat()
+                if (stat.st_mtime_ns, stat.st_size) != (mtime, size) and _file_digest(Path(path)) != digest:
+                    return None
+                refreshed.files[path] = [_stamp(stat, started), stat.st_size, digest]
+        except OSError:
+            return None
+        return refreshed
+
+@dataclass
+class Run:
+    """What a run depended on, and what it found"""
+    environment: str
+    project: Optional[str]
+    roots: Roots
+    tree: Tree
+    imports: Dict[str, List[str]]
+    # [code, msg, missing_package_name] for each warning
+    warnings: List[List[Optional[str]]]
+
+    @property
+    def warns(self) -> Tuple[Warn, ...]:
+        return tuple(Warn(Violation[str(code)], str(msg), pkg) for code, msg, pkg in self.warnings)
+
+    @staticmethod
+    def from_warns(warnings: Iterable[Warn]) -> List[List[Optional[str]]]:
+        return [[warning.code.name, warning.msg, warning.missing_package_name] for warning in warnings]
+
+def roots(project: Project, paths: Iterable[Path], tests: Optional[Iterable[Path]]) -> Roots:
+    tests = None if tests is None else list(tests)
+    include, exclude = project.dependency_roots(paths, exclude=tests or ())
+    return {
+        DEPENDENCIES: [list(map(str, include)), list(map(str, exclude))],
+        DEV_DEPENDENCIES: [list(map(str, project.dev_dependency_roots(tests))), []],
+    }
+
+class RunCache:
+    """Results of earlier runs, kept in cache_dir, one per set of arguments"""
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir = cache_dir
+
+    def path(self, analyzer: Analyzer, project_file: Optional[Path], paths: List[Path], tests: Optional[List[Path]]) -> Path:
+        args = [
+            str(Path.cwd()), None if project_file is None else str(project_file), list(map(str, paths)),
+            None if tests is None else list(map(str, tests)), analyzer.use_bytecode,
+            analyzer.prober is not None,
+        ]
+        return self.cache_dir / f'run-{_digest(json.dumps(args).encode("utf8"))}.json'
+
+    def read(self, path: Path) -> Optional[Run]:
+        with contextlib.suppress(OSError, ValueError, KeyError, TypeError):
+            with path.open(encoding='utf8') as infile:
+                data = json.load(infile)
+            if data.pop('omnidep-run') == RUN_VERSION:
+                data['tree'] = Tree(**data['tree'])
+                return Run(**data)
+        return None
+
+    def write(self, path: Path, run: Run) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        temp.write_text(json.dumps({'omnidep-run': RUN_VERSION, **asdict(run)}), encoding='utf8')
+        temp.replace(path)
+
+    def check(
+        self, analyzer: Analyzer, project_file: Optional[Path], paths: Iterable[Path] = (),
+        *, tests: Optional[Iterable[Path]] = None,
+    ) -> Tuple[Warn, ...]:
+        """Like Analyzer.check, reusing as much of the last run as possible"""
+        started = time.time_ns()
+        paths = list(paths)
+        tests = None if tests is None else list(tests)
+        path = self.path(analyzer, project_file, paths, tests)
+        environment = environment_fingerprint() + code_fingerprint()
+        project_digest = _file_digest(project_file) if project_file else None
+        last = self.read(path)
+        tree = last and last.tree.refresh(started)
+        if last and tree and last.environment == environment and last.project == project_digest:
+            logger.info("Nothing changed since the last run")
+            if tree != last.tree:
+                self.write(path, replace(last, tree=tree))
+            return last.warns
+        project = read_poetry(project_file)
+        searched = roots(project.value, paths, tests)
+        if last and tree and searched == last.roots:
+            logger.info("Source files unchanged since the last run: reusing its imports")
+            found = last.imports
+        else:
+            # Record the tree before reading it, so that any change while
+            # reading it shows up next time.
+            tree = Tree.scan(
+                (Path(root) for included, excluded in searched.values() for root in [*included, *excluded]),
+                started,
+            )
+            found = analyzer.find_imports(project.value, paths, tests=tests)
+        warnings = analyzer.check_imports(project, found)
+        self.write(path, Run(environment, project_digest, searched, tree, found, Run.from_warns(warnings)))
+        return warnings
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple,
+)
+
+from .errors import ConfigError, Warn, Warned
+from .imports import ReadImports, get_external_modules, read_imports
+from .packages import DistributionIndex
+
+if TYPE_CHECKING:
+    # The project module depends on the command line, which depends on this.
+    from .project import Project
+
+PARTIAL_VERSION = 1
+
+# Keys for the two import sets, named after the dependencies they're checked
+# against (and matching the labels used in warning messages).
+DEPENDENCIES = 'dependencies'
+DEV_DEPENDENCIES = 'dev-dependencies'
+
+@dataclass(frozen=True)
+class Shard:
+    """One of count parts of a project, numbered from 1"""
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls, text: str) -> Shard:
+        """Parse I/N, for use as an argparse type"""
+        index, sep, count = text.partition('/')
+        try:
+            shard = cls(int(index), int(count))
+        except ValueError:
+            shard = None
+        if not sep or shard is None or not 1 <= shard.index <= shard.count:
+            raise argparse.ArgumentTypeError(f"expected I/N with 1 <= I <= N, got {text!r}")
+        return shard
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    def contains(self, file: Path, root: Path) -> bool:
+        """
+        Is file part of this shard? The answer depends only on the path of the
+        file relative to root, so every node of a CI job agrees on it
+        regardless of where the project is checked out.
+        """
+        relative = Path(os.path.relpath(file, root)).as_posix()
+        digest = hashlib.sha1(relative.encode('utf8')).digest()  # noqa: S324: not security
+        return int.from_bytes(digest[:8], 'big') % self.count == self.index - 1
+
+    def select(self, files: Iterable[Path], root: Path) -> List[Path]:
+        return [file for file in files if self.contains(file, root)]
+
+@dataclass(frozen=True)
+class Partial:
+    """Imports found by some shards of a project"""
+    shards: FrozenSet[Shard] = frozenset()
+    imports: Dict[str, FrozenSet[str]] = field(default_factory=dict)
+
+    def missing_shards(self) -> List[Shard]:
+        counts = {shard.count for shard in self.shards}
+        if len(counts) > 1:
+            raise ConfigError(f"Partial results are from different numbers of shards: {sorted(counts)}")
+        return [
+            Shard(index, count)
+            for count in counts
+            for index in range(1, count + 1)
+            if Shard(index, count) not in self.shards
+        ]
+
+    def modules(self, label: str) -> List[str]:
+        return sorted(self.imports.get(label, ()))
+
+    def check(self, project: Warned[Project], index: Optional[DistributionIndex] = None) -> Tuple[Warn, ...]:
+        """
+        Run the project-level checks against the combined imports, without
+        reading any source files.
+        """
+        missing = self.missing_shards()
+        if missing:
+            raise ConfigError(f"Missing partial results for shard(s) {', '.join(map(str, missing))}")
+        return (
+            project
+            .collect(lambda x: x.check_dependency_imports(self.modules(DEPENDENCIES), index=index))
+            .collect(lambda x: x.check_dev_dependency_imports(self.modules(DEV_DEPENDENCIES), index=index))
+        ).warnings
+
+def find_imports(
+    project: Project, paths: Iterable[Path], tests: Optional[Iterable[Path]],
+    *, shard: Shard, root: Path, read: ReadImports = read_imports,
+) -> Dict[str, List[str]]:
+    """Find the imports in the part of the project belonging to shard"""
+    tests = None if tests is None else list(tests)
+    files = {
+        DEPENDENCIES: project.dependency_files(paths, exclude=tests or ()),
+        DEV_DEPENDENCIES: project.dev_dependency_files(tests),
+    }
+    return {
+        label: get_external_modules((file for file in found if shard.contains(file, root)), read)
+        for label, found in files.items()
+    }
+
+def write_partial(output: Path, shard: Optional[Shard], imports: Dict[str, List[str]], *, append: bool = False) -> None:
+    """
+    Write imports in the format read by read_partials. The format is JSON
+    lines, so that a file can be added to later with append=True.
+    """
+    records: List[object] = []
+    if not (append and output.exists()):
+        header: Dict[str, object] = {'omnidep-partial': PARTIAL_VERSION}
+        if shard is not None:
+            header['shard'] = str(shard)
+        records.append(header)
+    records.extend({'label': label, 'modules': modules} for label, modules in imports.items())
+    with output.open('a' if append else 'w', encoding='utf8') as outfile:
+        for record in records:
+            outfile.write(json.dumps(record) + '\n')
+
+def read_partials(files: Iterable[Path]) -> Partial:
+    """
+    Combine partial result files. There must be at least one, since with none
+    every dependency would look unused.
+    """
+    files = list(files)
+    if not files:
+        raise ConfigError("No partial result files specified")
+    shards: Set[Shard] = set()
+    imports: Dict[str, Set[str]] = {}
+    for file in files:
+        error = ConfigError(f"{str(file)!r} is not a partial result file from this version of omnidep")
+        try:
+            with file.open(encoding='utf8') as infile:
+                records = [json.loads(line) for line in infile if line.strip()]
+        except OSError as e:
+            raise ConfigError(f"Can't read partial result file {str(file)!r}: {e.strerror}") from None
+        except ValueError:
+            raise error from None
+        if not records or not isinstance(records[0], dict) or records[0].get('omnidep-partial') != PARTIAL_VERSION:
+            raise error
+        try:
+            if 'shard' in records[0]:
+                shards.add(Shard.parse(records[0]['shard']))
+            for record in records[1:]:
+                imports.setdefault(record['label'], set()).update(record['modules'])
+        except (argparse.ArgumentTypeError, KeyError, TypeError):
+            raise error from None
+    return Partial(frozenset(shards), {label: frozenset(mods) for label, mods in imports.items()})
@@ -0,0 +1,89 @@
+import asyncio
+from pathlib import Path
+import threading
+from typing import List, Tuple
+
+import pytest
+
+from omnidep.aio import AsyncAnalyzer
+from omnidep.analyzer import Analyzer
+from omnidep.errors import Violation, Warn
+
+from .analyzer_test import root_dir
+from .project_test import Codes, codes, plain_project_files
+
+def test_self() -> None:
+    async def check() -> Tuple[Warn, ...]:
+        async with AsyncAnalyzer() as checker:
+            return await checker.check(root_dir / 'pyproject.toml')
+    assert asyncio.run(check()) == Analyzer().check(root_dir / 'pyproject.toml')
+
+@pytest.mark.parametrize('projdir,expected,main,dev', plain_project_files)
+def test_known_project_files(projdir: Path, expected: Codes, main: Codes, dev: Codes) -> None:
+    """Must agree with Analyzer, in the same order"""
+    async def check() -> List[Warn]:
+        async with AsyncAnalyzer(jobs=2) as checker:
+            return [warning async for warning in checker.stream(projdir / 'pyproject.toml')]
+    assert codes(asyncio.run(check())) == expected + main + dev
+
+def test_streaming(tmp_path: Path) -> None:
+    """Warnings about the project file come before any source file is read"""
+    (tmp_path / 'pyproject.toml').write_text(
+        '[tool.poetry]\npackages = [{include = "example"}]\n'
+        '[tool.poetry.dependencies]\npython = "*"\ntomli = "*"\npytest = "*"\n'
+    )
+    (tmp_path / 'example').mkdir()
+    (tmp_path / 'example' / '__init__.py').write_text('import pytest\n')
+    analyzer = Analyzer()
+
+    async def check() -> List[Tuple[Violation, int]]:
+        async with AsyncAnalyzer(analyzer) as checker:
+            return [(warning.code, analyzer.misses) async for warning in checker.stream(tmp_path / 'pyproject.toml')]
+    assert asyncio.run(check()) == [(Violation.ODEP006, 0), (Violation.ODEP005, 1)]
+
+def test_check_many() -> None:
+    projects = [projdir / 'pyproject.toml' for projdir, *_ in plain_project_files]
+
+    async def check() -> List[Tuple[Path, Tuple[Warn, ...]]]:
+        async with AsyncAnalyzer() as checker:
+            return [result async for result in checker.check_many(projects, limit=2)]
+    results = dict(asyncio.run(check()))
+    analyzer = Analyzer()
+    assert results == {project: analyzer.check(project) for project in projects}
+
+def test_cancel(tmp_path: Path) -> None:
+    """Cancelling a check starts no more parsing, and doesn't wait for what's running"""
+    for idx in range(20):
+        (tmp_path / f'mod{idx}.py').write_text(f'import example{idx}\n')
+    release = threading.Event()
+    started: List[Path] = []
+
+    def read(file: Path) -> List[str]:
+        started.append(file)
+        release.wait(10)
+        return []
+    analyzer = Analyzer()
+    analyzer._read = read
+
+    async def check() -> None:
+        async with AsyncAnalyzer(analyzer, jobs=2) as checker:
+            task = asyncio.ensure_future(checker.external_modules(sorted(tmp_path.iterdir())))
+            while len(started) < 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+    asyncio.run(check())
+    release.set()
+    assert len(started) == 2
+
+def test_errors(tmp_path: Path) -> None:
+    (tmp_path / 'bad.py').write_text('print "python 2"\n')
+    with pytest.raises(ValueError, match='jobs'):
+        AsyncAnalyzer(jobs=0)
+
+    async def check() -> None:
+        async with AsyncAnalyzer() as checker:
+            await checker.external_modules([tmp_path / 'bad.py'])
+    with pytest.raises(SyntaxError):
+        asyncio.run(check())
@@ -0,0 +1,176 @@
+import os
+from pathlib import Path
+import threading
+import tracemalloc
+from typing import List
+
+import pytest
+
+from omnidep import project
+from omnidep.analyzer import Analyzer
+from omnidep.errors import Violation
+from omnidep.packages import DistributionIndex
+
+from .project_test import Codes, codes, plain_project_files
+
+test_dir = Path(__file__).parent
+root_dir = test_dir.parent.parent
+
+def test_self() -> None:
+    """Must be able to check self, by project file or by Project"""
+    loaded = project.read_poetry(root_dir / 'pyproject.toml')
+    expected = (
+        *loaded.warnings,
+        *loaded.value.check_dependencies([]),
+        *loaded.value.check_dev_dependencies(None),
+    )
+    analyzer = Analyzer()
+    assert analyzer.check(root_dir / 'pyproject.toml') == expected
+    assert analyzer.check(loaded.value) == expected
+
+def test_no_toml(caplog: pytest.LogCaptureFixture) -> None:
+    assert Analyzer().check(None) == ()
+    assert "pyproject.toml not specified" in caplog.text
+
+@pytest.mark.parametrize('projdir,expected,main,dev', plain_project_files)
+def test_known_project_files(projdir: Path, expected: Codes, main: Codes, dev: Codes) -> None:
+    """Must agree with checking the project directly"""
+    assert codes(Analyzer().check(projdir / 'pyproject.toml')) == expected + main + dev
+
+def test_cache_reused() -> None:
+    """Checking the same project twice must not parse anything again"""
+    analyzer = Analyzer()
+    first = analyzer.check(root_dir / 'pyproject.toml')
+    parsed = analyzer.misses
+    assert parsed > 0
+    assert analyzer.hits == 0
+    assert analyzer.check(root_dir / 'pyproject.toml') == first
+    assert analyzer.misses == parsed
+    assert analyzer.hits == parsed
+
+def test_cache_bounded(tmp_path: Path) -> None:
+    """The parse cache must never exceed its size"""
+    analyzer = Analyzer(cache_size=3)
+    files = [tmp_path / f'mod{idx}.py' for idx in range(10)]
+    for idx, file in enumerate(files):
+        file.write_text(f'import example{idx}\n')
+        assert analyzer.read_imports(file) == (f'example{idx}',)
+        assert len(analyzer._parsed) == min(idx + 1, 3)
+    # Most recent entries are kept, older ones must be parsed again.
+    analyzer.read_imports(files[-1])
+    assert analyzer.hits == 1
+    analyzer.read_imports(files[0])
+    assert analyzer.misses == 11
+
+def test_cache_disabled(tmp_path: Path) -> None:
+    analyzer = Analyzer(cache_size=0)
+    file = tmp_path / 'mod.py'
+    file.write_text('import example\n')
+    analyzer.read_imports(file)
+    analyzer.read_imports(file)
+    assert analyzer.misses == 2
+    assert len(analyzer._parsed) == 0
+    with pytest.raises(ValueError, match='cache_size'):
+        Analyzer(cache_size=-1)
+
+def test_cache_stale(tmp_path: Path) -> None:
+    """A file that has changed since it was parsed must be parsed again"""
+    analyzer = Analyzer()
+    file = tmp_path / 'mod.py'
+    file.write_text('import example1\n')
+    assert analyzer.read_imports(file) == ('example1',)
+    file.write_text('import example22\n')
+    # Make sure the timestamp differs even on coarse filesystems.
+    os.utime(file, ns=(0, 0))
+    assert analyzer.read_imports(file) == ('example22',)
+    assert analyzer.misses == 2
+
+def test_refresh() -> None:
+    analyzer = Analyzer()
+    other = Analyzer()
+    index = analyzer.index
+    assert analyzer.index is index
+    assert other.index is index
+    analyzer.refresh()
+    assert analyzer.index is not index
+    assert analyzer.index.modules == index.modules
+    # Only this Analyzer scans again
+    assert other.index is index
+    assert Analyzer().index is index
+
+def test_parse_while_scanning(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Files can be parsed while another thread is scanning the distributions"""
+    (tmp_path / 'mod.py').write_text('import example\n')
+    started = threading.Event()
+    parsed = threading.Event()
+    waited: List[bool] = []
+    scan = DistributionIndex.scan
+
+    def slow_scan() -> DistributionIndex:
+        started.set()
+        waited.append(parsed.wait(5))
+        return scan()
+    monkeypatch.setattr(DistributionIndex, 'scan', slow_scan)
+    analyzer = Analyzer()
+    analyzer.refresh()
+    scanning = threading.Thread(target=lambda: analyzer.index)
+    scanning.start()
+    assert started.wait(5)
+    assert analyzer.read_imports(tmp_path / 'mod.py') == ('example',)
+    parsed.set()
+    scanning.join()
+    assert waited == [True]
+
+def test_missing_dependency(tmp_path: Path) -> None:
+    """Results are the same Warn objects as the rest of omnidep produces"""
+    (tmp_path / 'pyproject.toml').write_text(
+        '[tool.poetry]\n'
+        'packages = [{include = "code"}]\n'
+        '[tool.poetry.dependencies]\n'
+        'python = "*"\n'
+    )
+    (tmp_path / 'code').mkdir()
+    (tmp_path / 'code' / '__init__.py').write_text('import pytest\n')
+    warnings = Analyzer().check(tmp_path / 'pyproject.toml')
+    assert codes(warnings) == [Violation.ODEP001]
+    assert warnings[0].missing_package_name == 'pytest'
+
+def make_tree(root: Path, count: int) -> Path:
+    """A project with count source files, importing the same few modules"""
+    root.mkdir()
+    (root / 'pyproject.toml').write_text(
+        '[tool.poetry]\npackages = [{include = "code"}]\n'
+        '[tool.poetry.dependencies]\npython = "*"\n'
+        '[tool.omnidep]\nlocal-test-paths = ["code/tests"]\n'
+    )
+    for idx in range(count):
+        directory = root / 'code' / ('tests' if idx % 10 == 0 else f'pkg{idx % 7}') / f'sub{idx % 13}'
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f'mod{idx}.py').write_text(f'import example{idx % 5}.sub, os\nfrom code import pkg{idx % 7}\n')
+    return root / 'pyproject.toml'
+
+def test_memory_bounded(tmp_path: Path) -> None:
+    """Memory use doesn't grow with the number of source files, only with the imports"""
+    small = project.read_poetry(make_tree(tmp_path / 'small', 200)).value
+    large = project.read_poetry(make_tree(tmp_path / 'large', 3000)).value
+    analyzer = Analyzer(cache_size=16)
+    expected = {
+        'dependencies': sorted(f'example{idx}.sub' for idx in range(5)),
+        'dev-dependencies': ['example0.sub'],
+    }
+    # Warm up anything allocated once for the life of the process.
+    assert analyzer.find_imports(large) == expected
+
+    def peak(tree: project.Project) -> int:
+        tracemalloc.start()
+        try:
+            assert analyzer.find_imports(tree) == expected
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    # pathlib interns the parts of every path, so now and again the table of
+    # interned strings is resized, which belongs to no run in particular.
+    small_peak, large_peak = (min(peak(tree) for _ in range(3)) for tree in (small, large))
+    # Holding the paths of the extra files would take megabytes.
+    assert large_peak < small_peak + 50_000
+    assert large_peak < 500_000
@@ -0,0 +1,141 @@
+import io
+from pathlib import Path, PurePosixPath
+import tarfile
+from typing import Dict
+import zipfile
+
+import pytest
+
+from omnidep import archive
+from omnidep.errors import Violation
+
+from .project_test import codes
+
+metadata = """\
+Metadata-Version: 2.1
+Name: example
+Version: 1.0
+Requires-Dist: PyTest (>=7)
+Requires-Dist: pyOpenSSL; python_version < "4"
+Requires-Dist: Coverage[toml] >= 5 ; extra == "cov"
+
+Some description mentioning Requires-Dist: not-a-requirement
+"""
+
+pyproject = """\
+[tool.poetry]
+name = "example"
+version = "1.0"
+packages = [{include = "example"}]
+
+[tool.poetry.dependencies]
+python = "*"
+
+[tool.poetry.group.dev.dependencies]
+coverage = "*"
+
+[tool.omnidep]
+local-test-paths = ["example/tests"]
+"""
+
+def make_wheel(path: Path, files: Dict[str, str]) -> Path:
+    with zipfile.ZipFile(path, 'w') as zipped:
+        zipped.writestr('example-1.0.dist-info/METADATA', metadata)
+        for name, content in files.items():
+            zipped.writestr(name, content)
+    return path
+
+def make_sdist(path: Path, files: Dict[str, str]) -> Path:
+    with tarfile.open(path, 'w:gz') as tarred:
+        for name, content in {'PKG-INFO': metadata, **files}.items():
+            data = content.encode('utf8')
+            info = tarfile.TarInfo(f'example-1.0/{name}')
+            info.size = len(data)
+            tarred.addfile(info, io.BytesIO(data))
+    return path
+
+def test_is_archive() -> None:
+    assert archive.is_wheel(Path('dist/foo-1.0-py3-none-any.whl'))
+    assert archive.is_sdist(Path('dist/foo-1.0.tar.gz'))
+    assert archive.is_sdist(Path('dist/FOO-1.0.ZIP'))
+    assert not archive.is_archive(Path('pyproject.toml'))
+    assert not archive.is_archive(Path('foo.py'))
+
+def test_requires_dist() -> None:
+    assert archive.requires_dist(metadata) == {'pytest', 'pyopenssl', 'coverage'}
+    assert archive.requires_dist('Name: example\n') == frozenset()
+
+def test_read_wheel(tmp_path: Path) -> None:
+    wheel = make_wheel(tmp_path / 'example-1.0-py3-none-any.whl', {
+        'example/__init__.py': 'import pytest\nfrom . import other\n',
+        'example/data.txt': 'import not_code',
+    })
+    contents = archive.read_archive(wheel)
+    assert contents.metadata == metadata
+    assert contents.imports == {PurePosixPath('example/__init__.py'): ['pytest']}
+    assert contents.pyproject is None
+
+def test_check_wheel(tmp_path: Path) -> None:
+    wheel = make_wheel(tmp_path / 'example-1.0-py3-none-any.whl', {
+        'example/__init__.py': 'import pytest\nimport example.sub\n',
+        'example/sub.py': 'import OpenSSL\nimport yaml_not_installed\n',
+        'example_helper.py': 'import example\n',
+    })
+    warnings = archive.check_archive(wheel)
+    assert codes(warnings) == [Violation.ODEP002, Violation.ODEP005]
+    assert "yaml_not_installed" in warnings[0].msg
+    assert "['coverage']" in warnings[1].msg
+
+def test_check_wheel_with_project(tmp_path: Path) -> None:
+    """Tests in the wheel are identified by the config in the project file"""
+    wheel = make_wheel(tmp_path / 'example-1.0-py3-none-any.whl', {
+        'example/__init__.py': 'import OpenSSL, pytest, coverage\n',
+        'example/tests/test_it.py': 'import example, pytest, coverage\n',
+    })
+    (tmp_path / 'pyproject.toml').write_text(pyproject)
+    assert archive.check_archive(wheel) == ()
+    wheel = make_wheel(tmp_path / 'example-1.0-py3-none-any.whl', {
+        'example/__init__.py': 'import OpenSSL, pytest\n',
+        'example/tests/test_it.py': 'import example, pytest, coverage\n',
+    })
+    assert codes(archive.check_archive(wheel, tmp_path / 'pyproject.toml')) == [Violation.ODEP005]
+    # Without the config, all code is non-test code
+    assert codes(archive.check_archive(wheel)) == []
+
+def test_check_sdist(tmp_path: Path) -> None:
+    """The sdist supplies its own config, and code outside packages is ignored"""
+    sdist = make_sdist(tmp_path / 'example-1.0.tar.gz', {
+        'pyproject.toml': pyproject,
+        'setup.py': 'import not_installed_1\n',
+        'docs/conf.py': 'import not_installed_2\n',
+        'example/__init__.py': 'import OpenSSL, pytest, coverage\n',
+        'example/tests/__init__.py': '',
+        'example/tests/test_it.py': 'import example, pytest, coverage\n',
+    })
+    assert archive.check_archive(sdist) == ()
+    sdist = make_sdist(tmp_path / 'example-1.0.tar.gz', {
+        'pyproject.toml': pyproject,
+        'example/__init__.py': 'import OpenSSL, pytest, no_such_module\n',
+        'example/tests/test_it.py': 'import no_such_module_in_tests\n',
+    })
+    warnings = archive.check_archive(sdist)
+    assert codes(warnings) == [Violation.ODEP002, Violation.ODEP005, Violation.ODEP002]
+
+def test_check_sdist_without_poetry(tmp_path: Path) -> None:
+    sdist = make_sdist(tmp_path / 'example-1.0.tar.gz', {
+        'example/__init__.py': 'import OpenSSL, pytest, coverage\n',
+        'example/tests/test_it.py': 'import example, pytest, coverage\n',
+    })
+    assert archive.check_archive(sdist) == ()
+
+@pytest.mark.parametrize('name', ['example-1.0-py3-none-any.whl', 'example-1.0.tar.gz'])
+def test_no_metadata(tmp_path: Path, name: str) -> None:
+    bad = tmp_path / name
+    if archive.is_wheel(bad):
+        with zipfile.ZipFile(bad, 'w') as zipped:
+            zipped.writestr('example/__init__.py', '')
+    else:
+        with tarfile.open(bad, 'w:gz'):
+            pass
+    with pytest.raises(FileNotFoundError):
+        archive.check_archive(bad)
@@ -0,0 +1,140 @@
+import importlib.util
+import os
+from pathlib import Path
+import py_compile
+import shutil
+from unittest import mock
+
+import pytest
+
+from omnidep import bytecode, imports
+from omnidep.analyzer import Analyzer
+
+test_dir = Path(__file__).parent
+
+source = '''\
+from __future__ import annotations
+import a.b.c, d
+from e.f import (g,
+    h as i)
+from j import *
+from . import bad
+from .bad import worse
+try:
+    import k
+except ImportError:
+    k = None
+
+class L:
+    from m import n
+
+def o():
+    def p():
+        import q.r
+'''
+
+def compiled(tmp_path: Path, text: str, mode: py_compile.PycInvalidationMode = py_compile.PycInvalidationMode.TIMESTAMP) -> Path:
+    file = tmp_path / 'code.py'
+    file.write_text(text)
+    py_compile.compile(str(file), doraise=True, invalidation_mode=mode)
+    return file
+
+@pytest.mark.parametrize('mode', list(py_compile.PycInvalidationMode))
+def test_same_as_parsing(tmp_path: Path, mode: py_compile.PycInvalidationMode) -> None:
+    file = compiled(tmp_path, source, mode)
+    found = bytecode.cached_imports(file)
+    assert found is not None
+    assert sorted(found) == sorted(imports.read_imports(file)) == [
+        '__future__.annotations', 'a.b.c', 'd', 'e.f.g', 'e.f.h', 'j', 'k', 'm.n', 'q.r',
+    ]
+
+def test_no_cache(tmp_path: Path) -> None:
+    file = tmp_path / 'code.py'
+    file.write_text(source)
+    assert bytecode.cached_imports(file) is None
+    assert bytecode.read_imports(file) == imports.read_imports(file)
+
+def test_stale_timestamp(tmp_path: Path) -> None:
+    file = compiled(tmp_path, source)
+    file.write_text(source + 'import extra\n')
+    assert bytecode.cached_imports(file) is None
+    assert 'extra' in bytecode.read_imports(file)
+
+@pytest.mark.parametrize('mode', [
+    py_compile.PycInvalidationMode.CHECKED_HASH,
+    py_compile.PycInvalidationMode.UNCHECKED_HASH,
+])
+def test_stale_hash(tmp_path: Path, mode: py_compile.PycInvalidationMode) -> None:
+    """Hash-based pycs are checked even if they say not to be"""
+    file = compiled(tmp_path, source, mode)
+    stat = file.stat()
+    file.write_text(source.replace('(g,', '(x,'))
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert bytecode.cached_imports(file) is None
+    assert 'e.f.x' in bytecode.read_imports(file)
+
+def test_bad_cache(tmp_path: Path) -> None:
+    file = compiled(tmp_path, source)
+    cache = Path(importlib.util.cache_from_source(str(file)))
+    data = cache.read_bytes()
+    cache.write_bytes(b'\0\0\0\0' + data[4:])
+    assert bytecode.cached_imports(file) is None
+    cache.write_bytes(data[:20])
+    assert bytecode.cached_imports(file) is None
+    cache.write_bytes(data[:4] + b'\xff' + data[5:])
+    assert bytecode.cached_imports(file) is None
+
+def test_dead_code(tmp_path: Path) -> None:
+    """Imports discarded by the compiler are found by parsing instead"""
+    file = tmp_path / 'every_import.py'
+    shutil.copy(test_dir / 'test_cases' / 'every_import.py~', file)
+    py_compile.compile(str(file), doraise=True)
+    assert bytecode.cached_imports(file) is None
+    assert bytecode.read_imports(file) == imports.read_imports(file)
+    file = compiled(tmp_path, 'def f():\n    return\n    import unreachable\n')
+    assert bytecode.cached_imports(file) is None
+
+def test_finally(tmp_path: Path) -> None:
+    """Code in finally blocks is compiled twice, so its imports are found twice"""
+    file = compiled(tmp_path, 'try:\n    pass\nfinally:\n    import a\n')
+    found = bytecode.cached_imports(file)
+    assert found is not None
+    assert set(found) == set(imports.read_imports(file)) == {'a'}
+
+def test_extended_arg(tmp_path: Path) -> None:
+    """Constants after the first 256 are loaded with a longer argument"""
+    text = ''.join(f'x{idx} = {idx}.5\n' for idx in range(300)) + 'from a import b\n'
+    file = compiled(tmp_path, text)
+    assert bytecode.cached_imports(file) == ['a.b']
+
+def test_instruction_before() -> None:
+    code = bytes([bytecode.EXTENDED_ARG, 1, bytecode.LOAD_CONST, 2, bytecode.LOAD_CONST, 3])
+    assert bytecode._instruction_before(code, 6) == (4, bytecode.LOAD_CONST, 3)
+    assert bytecode._instruction_before(code, 4) == (0, bytecode.LOAD_CONST, 258)
+    assert bytecode._instruction_before(code, 0) == (-1, -1, 0)
+    # Inline caches, in Python versions that have them, are skipped.
+    cached = code + bytes([bytecode.CACHE or 0, 0])
+    assert bytecode._instruction_before(cached, 8)[0] == (6 if bytecode.CACHE is None else 4)
+    assert bytecode._const(compile('', '', 'exec'), -1, 0) is bytecode.NOT_CONSTANT
+
+def test_unexpected_bytecode(tmp_path: Path) -> None:
+    """If the import level isn't a constant int, the bytecode isn't used"""
+    code = compile('import a\n', 'code.py', 'exec')
+    assert bytecode.code_imports(code) == [(['a'], 1)]
+    consts = tuple('x' if const == 0 else const for const in code.co_consts)
+    assert bytecode.code_imports(code.replace(co_consts=consts)) is None
+    with mock.patch('omnidep.bytecode.code_imports', return_value=None):
+        assert bytecode.cached_imports(compiled(tmp_path, 'import a\n')) is None
+
+def test_import_lines() -> None:
+    text = b'import a\n# import b\nx = "import c"\n\n  from d import e\nimportlib = 1\n'
+    assert list(bytecode.import_lines(text)) == [1, 5]
+    # A docstring mentioning import is harmless: it just means parsing.
+    assert list(bytecode.import_lines(b'"""\nDo not import this\n"""\n')) == [2]
+
+def test_analyzer(tmp_path: Path) -> None:
+    file = compiled(tmp_path, source)
+    with mock.patch('omnidep.imports.parse_imports') as parse:
+        names = Analyzer(use_bytecode=True).read_imports(file)
+    assert parse.call_count == 0
+    assert sorted(names) == sorted(imports.read_imports(file))
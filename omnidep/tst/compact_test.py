@@ -0,0 +1,109 @@
+import mmap
+from pathlib import Path
+import sys
+import tracemalloc
+from typing import Dict, List
+
+import pytest
+
+from omnidep.compact import CompactMap, LayeredMap
+from omnidep.packages import DistributionIndex
+
+example = {
+    'b': ['x', 'y'],
+    'a': ['y'],
+    'ab': ['z', 'x', 'x'],
+    'a.b': ['x'],
+    'é': [],
+}
+
+def test_mapping() -> None:
+    compact = CompactMap.build(example)
+    assert len(compact) == 5
+    assert dict(compact) == {
+        'a': ('y',),
+        'a.b': ('x',),
+        'ab': ('x', 'z'),
+        'b': ('x', 'y'),
+        'é': (),
+    }
+    assert compact['ab'] == ('x', 'z')
+    assert compact.get('c') is None
+    assert 'a.b' in compact
+    assert '' not in compact
+    with pytest.raises(KeyError):
+        compact['abc']
+
+def test_layered() -> None:
+    compact = CompactMap.build(example)
+    layered = LayeredMap(compact, {'ab': ['w', 'x'], 'c': ['z']})
+    assert layered.base is compact
+    assert len(layered) == 6
+    assert dict(layered) == {**compact, 'ab': ('w', 'x', 'z'), 'c': ('z',)}
+    assert layered['a.b'] == ('x',)
+    assert layered.get('d') is None
+    assert dict(LayeredMap(layered, {'c': ['y']})) == {**layered, 'c': ('y', 'z')}
+
+def test_empty() -> None:
+    compact = CompactMap.build({})
+    assert len(compact) == 0
+    assert dict(compact) == {}
+    assert compact.get('a') is None
+
+def test_interned() -> None:
+    """Values are shared, not duplicated per key"""
+    compact = CompactMap.build(example)
+    assert compact['a'][0] is compact['b'][1]
+    assert compact['a'][0] is sys.intern('y')
+
+def test_bytes() -> None:
+    compact = CompactMap.build(example)
+    data = compact.tobytes()
+    assert len(data) == compact.nbytes
+    assert len(data) % 4 == 0
+    # Trailing data is not part of the map
+    assert dict(CompactMap(data + b'more')) == dict(compact)
+    assert CompactMap(data + b'more').tobytes() == data
+
+def test_mmap(tmp_path: Path) -> None:
+    path = tmp_path / 'map.bin'
+    path.write_bytes(CompactMap.to_bytes(example))
+    with path.open('rb') as infile:
+        mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    assert dict(CompactMap(mapped)) == dict(CompactMap.build(example))
+
+@pytest.mark.parametrize('cut', [0, 4, 23, 24, 40])
+def test_truncated(cut: int) -> None:
+    data = CompactMap.to_bytes(example)
+    with pytest.raises(ValueError, match='truncated'):
+        CompactMap(data[:cut])
+
+def test_not_compact() -> None:
+    with pytest.raises(ValueError, match='not a CompactMap'):
+        CompactMap(b'\0' * 64)
+
+def test_memory() -> None:
+    """
+    Measure the memory used by the index of the current environment, against
+    the dict of lists it replaced.
+    """
+    scanned = DistributionIndex.scan().modules
+    items = {key: list(value) for key, value in scanned.items()}
+    def measure_dict() -> Dict[str, List[str]]:
+        # Fresh strings, as if from scanning.
+        return {(key + '.')[:-1]: [(val + '.')[:-1] for val in vals] for key, vals in items.items()}
+    def measure_compact() -> CompactMap:
+        return CompactMap.build(items)
+    sizes = []
+    for func in (measure_dict, measure_compact):
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            kept = func()
+            sizes.append(tracemalloc.get_traced_memory()[0] - before)
+            del kept
+        finally:
+            tracemalloc.stop()
+    dict_size, compact_size = sizes
+    print(f"{len(items)} modules: dict {dict_size} bytes, compact {compact_size} bytes")
+    assert compact_size < dict_size
@@ -0,0 +1,124 @@
+import argparse
+import ast
+from pathlib import Path
+from typing import List, Optional
+
+from flake8.main.cli import main as flake8_main
+import pytest
+
+from omnidep.analyzer import Analyzer
+from omnidep.errors import Violation
+from omnidep.flake8_plugin import Plugin
+from omnidep.project import read_poetry
+from omnidep.shard import read_partials
+
+from .project_test import codes
+
+pyproject = """\
+[tool.poetry]
+name = "example"
+version = "1.0"
+packages = [{include = "example"}]
+
+[tool.poetry.dependencies]
+python = "*"
+pytest = "*"
+tomli = "*"
+
+[tool.omnidep]
+local-test-paths = ["tests"]
+"""
+
+@pytest.fixture()
+def project(tmp_path: Path) -> Path:
+    (tmp_path / 'example').mkdir()
+    (tmp_path / 'example' / '__init__.py').write_text('import os\nimport pytest, coverage.data, coverage.files\n')
+    (tmp_path / 'example' / 'more.py').write_text('def f():\n    from no_such_module import x\n    import example\n')
+    (tmp_path / 'tests').mkdir()
+    (tmp_path / 'tests' / 'test_example.py').write_text('import coverage\n')
+    (tmp_path / 'pyproject.toml').write_text(pyproject)
+    return tmp_path
+
+def run(project: Path, file: Path, partials: Optional[Path] = None) -> List[str]:
+    Plugin.parse_options(argparse.Namespace(
+        omnidep_project=str(project / 'pyproject.toml'), omnidep_cache_dir=None,
+        omnidep_partials=None if partials is None else str(partials),
+    ))
+    results = Plugin(ast.parse(file.read_text()), str(file)).run()
+    return [f'{line}:{col} {msg}' for line, col, msg, cls in results if cls is Plugin]
+
+def test_plugin(project: Path) -> None:
+    assert run(project, project / 'example' / '__init__.py') == [
+        "2:0 ODEP001 Package 'coverage' is imported but not listed in dependencies",
+    ]
+    assert run(project, project / 'example' / 'more.py') == [
+        "2:4 ODEP002 Module 'no_such_module' is imported but not installed, so I don't know what package is needed",
+    ]
+    # Files in local-test-paths are checked against dev-dependencies
+    assert run(project, project / 'tests' / 'test_example.py') == [
+        "1:0 ODEP001 Package 'coverage' is imported but not listed in dev-dependencies",
+    ]
+
+def test_other_files(project: Path) -> None:
+    """Files that omnidep wouldn't check, outside the packages and tests, aren't checked"""
+    (project / 'docs').mkdir()
+    (project / 'docs' / 'conf.py').write_text('import coverage\n')
+    (project / 'setup.py').write_text('import coverage\n')
+    assert run(project, project / 'docs' / 'conf.py') == []
+    assert run(project, project / 'setup.py') == []
+
+def test_partials(project: Path, tmp_path: Path) -> None:
+    """The imports written by the plugin give the same project-level result"""
+    partials = tmp_path / 'partials'
+    for file in sorted(project.glob('*/*.py')):
+        run(project, file, partials)
+    written = list(partials.iterdir())
+    assert len(written) == 1
+    project_file = project / 'pyproject.toml'
+    merged = read_partials(written).check(read_poetry(project_file))
+    assert merged == Analyzer().check(project_file)
+    assert Violation.ODEP005 in codes(merged)
+
+def test_flake8(project: Path, tmp_path: Path, capsys: pytest.CaptureFixture[str], monkeypatch: pytest.MonkeyPatch) -> None:
+    """The plugin works in flake8's worker processes"""
+    (project / 'docs').mkdir()
+    (project / 'docs' / 'conf.py').write_text('import coverage\n')
+    (project / 'setup.py').write_text('import setuptools\n')
+    (tmp_path / 'setup.cfg').write_text(
+        '[flake8]\nselect = ODEP\nenable-extensions = ODE\n'
+        '[flake8:local-plugins]\nextension =\n    ODE = omnidep.flake8_plugin:Plugin\n'
+    )
+    monkeypatch.chdir(tmp_path)
+    assert flake8_main(['--jobs', '2', '--omnidep-partials', 'partials', '.']) == 1
+    assert sorted(capsys.readouterr().out.splitlines()) == [
+        "./example/__init__.py:2:1: ODEP001 Package 'coverage' is imported but not listed in dependencies",
+        "./example/more.py:2:5: ODEP002 Module 'no_such_module' is imported but not installed, so I don't know what package is needed",
+        "./tests/test_example.py:1:1: ODEP001 Package 'coverage' is imported but not listed in dev-dependencies",
+    ]
+    merged = read_partials((tmp_path / 'partials').iterdir()).check(read_poetry(project / 'pyproject.toml'))
+    assert merged == Analyzer().check(project / 'pyproject.toml')
+
+@pytest.mark.parametrize('toml', [None, '[project]\nname = "example"\n', 'not toml ['])
+def test_not_poetry(tmp_path: Path, toml: Optional[str], caplog: pytest.LogCaptureFixture) -> None:
+    """A project the plugin can't read, where it's enabled by a shared config, isn't checked, and isn't an error"""
+    if toml is not None:
+        (tmp_path / 'pyproject.toml').write_text(toml)
+    (tmp_path / 'code.py').write_text('import coverage\n')
+    assert run(tmp_path, tmp_path / 'code.py') == []
+    assert run(tmp_path, tmp_path / 'code.py') == []
+    assert len([record for record in caplog.records if 'not checking imports' in record.message]) == 1
+
+def test_off_by_default(project: Path, capsys: pytest.CaptureFixture[str], monkeypatch: pytest.MonkeyPatch) -> None:
+    (project / 'setup.cfg').write_text('[flake8]\nselect = ODEP\n[flake8:local-plugins]\nextension =\n    ODE = omnidep.flake8_plugin:Plugin\n')
+    monkeypatch.chdir(project)
+    assert flake8_main(['.']) == 0
+    assert capsys.readouterr().out == ''
+    assert flake8_main(['--enable-extensions', 'ODE', '.']) == 1
+    assert len(capsys.readouterr().out.splitlines()) == 3
+
+def test_flake8_no_project(tmp_path: Path, capsys: pytest.CaptureFixture[str], monkeypatch: pytest.MonkeyPatch) -> None:
+    (tmp_path / 'setup.cfg').write_text('[flake8]\nselect = ODEP\nenable-extensions = ODE\n[flake8:local-plugins]\nextension =\n    ODE = omnidep.flake8_plugin:Plugin\n')
+    (tmp_path / 'code.py').write_text('import coverage\n')
+    monkeypatch.chdir(tmp_path)
+    assert flake8_main(['code.py']) == 0
+    assert capsys.readouterr().out == ''
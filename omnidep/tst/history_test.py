@@ -0,0 +1,123 @@
+import os
+from pathlib import Path
+import subprocess
+from typing import Dict, List, Optional
+from unittest import mock
+
+import pytest
+
+from omnidep import history
+from omnidep.command import CommandLine, parse_command_line
+from omnidep.errors import ConfigError, Violation
+from omnidep.main import run
+
+from .project_test import codes
+
+pyproject = """\
+[tool.poetry]
+name = "example"
+version = "1.0"
+packages = [{include = "example"}]
+
+[tool.poetry.dependencies]
+python = "*"
+pytest = "*"
+
+[tool.omnidep]
+local-test-paths = ["tests"]
+"""
+
+def git(repo: Path, *args: str) -> str:
+    env = {
+        **os.environ,
+        'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+        'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+    }
+    result = subprocess.run(['git', *args], cwd=repo, env=env, check=True, capture_output=True, text=True)  # noqa: S603, S607
+    return result.stdout.strip()
+
+def commit(repo: Path, message: str, files: Dict[str, Optional[str]]) -> str:
+    for name, text in files.items():
+        path = repo / name
+        if text is None:
+            path.unlink()
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text)
+    git(repo, 'add', '-A')
+    git(repo, 'commit', '-q', '--allow-empty', '-m', message)
+    return git(repo, 'rev-parse', 'HEAD')
+
+@pytest.fixture()
+def repo(tmp_path: Path) -> List[str]:
+    git(tmp_path, 'init', '-q')
+    return [
+        commit(tmp_path, 'Start', {'README': 'hello\n'}),
+        commit(tmp_path, 'Add project', {
+            'pyproject.toml': pyproject,
+            'example/__init__.py': 'import pytest\n',
+            'example/sub/code.py': 'import example\n',
+            'tests/test_example.py': 'import pytest\n',
+        }),
+        commit(tmp_path, 'Use coverage', {'example/sub/code.py': 'import example, coverage\n'}),
+        commit(tmp_path, 'Docs', {'README': 'hello again\n'}),
+        commit(tmp_path, 'Depend on coverage', {'pyproject.toml': pyproject.replace('pytest', 'coverage = "*"\npytest')}),
+        commit(tmp_path, 'Broken config', {'pyproject.toml': pyproject + 'no-such-option = 1\n'}),
+        commit(tmp_path, 'Bad syntax', {
+            'pyproject.toml': pyproject.replace('pytest', 'coverage = "*"\npytest'),
+            'tests/old.py': 'print "python 2"\n',
+        }),
+    ]
+
+def test_history(tmp_path: Path, repo: List[str]) -> None:
+    checker = history.History(tmp_path)
+    results = list(checker.check(f'{repo[0]}..HEAD', 'pyproject.toml'))
+    assert [result.commit for result in results] == repo[1:]
+    assert [result.subject for result in results] == [
+        'Add project', 'Use coverage', 'Docs', 'Depend on coverage', 'Broken config', 'Bad syntax',
+    ]
+    assert [None if result.warnings is None else codes(result.warnings) for result in results] == [
+        [], [Violation.ODEP001], [Violation.ODEP001], [], None, [],
+    ]
+    assert "not recognised" in str(results[4].note)
+    # Each version of each file is parsed once, however many commits it's in,
+    # and files with the same contents are the same blob.
+    assert checker.parsed == 4
+    # Commits without the project file are included
+    first = list(checker.check(repo[0], 'pyproject.toml'))
+    assert [(result.warnings, result.note) for result in first] == [(None, 'no pyproject.toml')]
+
+def test_unchanged_commits(tmp_path: Path, repo: List[str]) -> None:
+    """Commits that change nothing relevant reuse the last result"""
+    checker = history.History(tmp_path)
+    with mock.patch.object(checker.analyzer, 'check_imports', side_effect=checker.analyzer.check_imports) as check:
+        list(checker.check(f'{repo[1]}..{repo[4]}', 'pyproject.toml'))
+    assert check.call_count == 2
+
+def test_bad_range(tmp_path: Path, repo: List[str]) -> None:
+    with pytest.raises(ConfigError, match='rev-list'):
+        list(history.History(tmp_path).check('nonexistent..HEAD', 'pyproject.toml'))
+    with history.GitObjects(tmp_path) as objects, pytest.raises(ConfigError, match='not found'):
+        objects.read('0' * 40)
+
+def test_select() -> None:
+    files = {'a/b.py': '1', 'a/b.txt': '2', 'ab.py': '3', 'a/c/d.py': '4', 'e.py': '5'}
+    assert sorted(history.select(files, [Path('a')])) == ['a/b.py', 'a/c/d.py']
+    assert sorted(history.select(files, [Path('e.py'), Path('a/c/')])) == ['a/c/d.py', 'e.py']
+    assert len(history.select(files, [Path()])) == 4
+
+def test_command_line(tmp_path: Path, repo: List[str], capsys: pytest.CaptureFixture[str], monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path / 'example')
+    args = parse_command_line(['../pyproject.toml', '--git-range', f'{repo[1]}..{repo[4]}'])
+    assert isinstance(args, CommandLine)
+    assert run(args) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        f'{repo[2][:12]} Use coverage',
+        "  + ODEP001: Package 'coverage' is imported but not listed in dependencies",
+        f'{repo[3][:12]} Docs',
+        f'{repo[4][:12]} Depend on coverage',
+        "  - ODEP001: Package 'coverage' is imported but not listed in dependencies",
+    ]
+    assert run(parse_command_line(['../pyproject.toml', '--git-range', f'{repo[1]}..{repo[3]}'])) == 1
+    with pytest.raises(SystemExit, match='requires pyproject.toml'):
+        run(parse_command_line(['.', '--git-range', 'HEAD']))
@@ -22,20 +22,36 @@ def test_is_external() -> None:
     assert imports.is_external('pytest')
     # Not strictly true, but for our purposes
     assert not imports.is_external('setuptools')
+    # Cached, but not without limit
+    assert imports.is_external.cache_info().maxsize is not None
 
 def test_get_external_modules() -> None:
     results = imports.get_external_modules([test_dir])
     assert 'pathlib' not in results
     assert 'unittest' not in results
-    assert 'omnidep' in results
+    assert 'unittest.mock' not in results
+    assert 'omnidep.imports' in results
 
 def test_every_import() -> None:
     test_file = test_dir / 'test_cases' / 'every_import.py~'
     with mock.patch('omnidep.imports.find_source_files') as find:
         find.return_value = [test_file]
         results = list(imports.get_external_modules([Path('.')]))
+    tops = sorted(set(map(imports.top_level, results)))
     # Must not think 'bad' is a top-level import, in any place it occurs
-    assert 'bad' not in results
-    # Must find all the expected top-level imports, once each
+    assert 'bad' not in tops
+    # Must find all the expected top-level imports
     expected_results = sorted(f'example{x}' for x in range(1, 25))
-    assert results == expected_results
+    assert tops == expected_results
+    # Results are unique
+    assert len(results) == len(set(results))
+
+def test_dotted_names() -> None:
+    source = '''
+import a.b.c, d
+from e.f import g, h as i
+from j import *
+from . import bad
+from .bad import worse
+'''
+    assert sorted(imports.parse_imports(source)) == ['a.b.c', 'd', 'e.f.g', 'e.f.h', 'j']
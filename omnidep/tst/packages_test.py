@@ -1,10 +1,22 @@
 
+import io
+import os
 from pathlib import Path
 import sys
+from typing import Dict, List
+from unittest import mock
 
 import pytest
 
+if sys.version_info < (3, 8):
+    import importlib_metadata as metadata
+else:
+    from importlib import metadata
+
 from omnidep import packages
+from omnidep.command import WhichCommandLine, parse_command_line
+from omnidep.compact import CompactMap
+from omnidep.main import run
 
 first_names = ('foo', 'Foo', 'FOO')
 last_names = ('bar', 'Bar', 'BAR')
@@ -67,3 +79,295 @@ def test_find_packages() -> None:
     result = packages.find_packages('tst', frozenset())
     assert result.value == []
     assert result.warnings == ()
+
+def test_known_modules() -> None:
+    known = packages.known_modules()
+    assert known['yaml'] == 'pyyaml'
+    assert known['bs4'] == 'beautifulsoup4'
+    assert all(part.isidentifier() for module in known for part in module.split('.'))
+    assert all(packages.canon(dist) == dist for dist in known.values())
+    # Where a known module is installed, the guess is right.
+    index = packages.current_index()
+    for module, dist in known.items():
+        _, installed = index.resolve(module)
+        if installed:
+            assert dist in map(packages.canon, installed), module
+
+def test_known_modules_format(tmp_path: Path) -> None:
+    bad = tmp_path / 'known_modules.txt'
+    packages.known_modules.cache_clear()
+    try:
+        with mock.patch.object(packages, 'KNOWN_MODULES_FILE', bad):
+            bad.write_text('# comment\nomnidep-known-modules 999\nyaml pyyaml\n')
+            with pytest.raises(ValueError, match='not in a supported format'):
+                packages.known_modules()
+            bad.write_text('omnidep-known-modules 1\nyaml pyyaml\nbs4\n')
+            with pytest.raises(ValueError, match="got 'bs4'"):
+                packages.known_modules()
+            bad.write_text('omnidep-known-modules 1\n# comment\nyaml pyyaml\n')
+            assert packages.known_modules() == {'yaml': 'pyyaml'}
+    finally:
+        packages.known_modules.cache_clear()
+
+def test_known_distribution() -> None:
+    assert packages.known_distribution('yaml') == ('yaml', 'pyyaml')
+    assert packages.known_distribution('google.protobuf.message') == ('google.protobuf', 'protobuf')
+    assert packages.known_distribution('google.other') == ('', None)
+    assert packages.known_distribution('no_such_module') == ('', None)
+
+def test_find_known(caplog: pytest.LogCaptureFixture) -> None:
+    """Modules that aren't installed are looked up in the list of known modules, with a warning"""
+    empty = packages.DistributionIndex({}, {})
+    with mock.patch.object(sys, 'path', []):
+        result = packages.find_packages('bs4.element', frozenset(), empty)
+        assert result.value == ['beautifulsoup4']
+        assert result.warnings == ()
+        assert "'bs4' is not installed: assuming it is provided by 'beautifulsoup4'" in caplog.text
+        assert packages.import_key('google.protobuf.message', frozenset(), empty) == 'google.protobuf'
+        assert packages.import_key('google.other', frozenset(), empty) == 'google'
+        # The live environment takes priority
+        installed = packages.DistributionIndex({'bs4': ['other']}, {})
+        assert packages.find_packages('bs4', frozenset(), installed).value == ['other']
+
+def test_requirement_names() -> None:
+    requirements = [
+        'PyTest (>=7)',
+        'pyOpenSSL; python_version < "4"',
+        'Coverage[toml] >= 5 ; extra == "cov"',
+        'zope.interface',
+        '; not a requirement',
+    ]
+    assert packages.requirement_names(requirements) == {'pytest', 'pyopenssl', 'coverage', 'zope-interface'}
+    assert packages.requirement_names(requirements, extras=False) == {'pytest', 'pyopenssl', 'zope-interface'}
+
+def test_required_by() -> None:
+    index = packages.current_index()
+    assert 'pytest-cov' in index.required_by['coverage']
+    assert 'pytest-cov' in index.required_by['pytest']
+
+def test_index_modules() -> None:
+    """Names that can't be imported are not indexed"""
+    modules = packages.current_index().modules
+    assert all(part.isidentifier() for name in modules for part in name.split('.'))
+    assert modules['pytest'] == ('pytest',)
+    # Submodules and subpackages are indexed too, but not __pycache__
+    assert modules['_pytest.mark'] == ('pytest',)
+    assert modules['_pytest.mark.structures'] == ('pytest',)
+    assert not any('__pycache__' in name for name in modules)
+
+def test_index_rules() -> None:
+    """The index records why each distribution provides each module"""
+    rules = packages.current_index().rules
+    assert set(rules['pytest']) == {'pytest top_level.txt', 'pytest package'}
+    assert rules['_pytest.mark'] == ('pytest package',)
+    assert rules['_pytest.mark.structures'] == ('pytest module',)
+
+@pytest.mark.parametrize('compact', [True, False])
+def test_resolve(*, compact: bool) -> None:
+    """The deepest part of the name that's indexed decides who provides it"""
+    modules = {
+        'a': ['a-api', 'a-sdk'],
+        'a.api': ['a-api'],
+        'a.sdk': ['a-sdk'],
+        'a.sdk.trace': ['a-sdk'],
+        'a-b': ['other'],
+        'ab': ['ab'],
+    }
+    index = packages.DistributionIndex(
+        CompactMap.build(modules) if compact else modules, {},
+    )
+    assert index.resolve('a') == ('a', ('a-api', 'a-sdk') if compact else ['a-api', 'a-sdk'])
+    assert tuple(index.resolve('a.sdk.trace.x')[1]) == ('a-sdk',)
+    assert index.resolve('a.sdk.trace.x')[0] == 'a.sdk.trace'
+    assert index.resolve('a.api.b')[0] == 'a.api'
+    assert index.resolve('a.other')[0] == 'a'
+    assert index.resolve('ab.c')[0] == 'ab'
+    assert index.resolve('b') == ('', ())
+    assert index.resolve('')[0] == ''
+
+def test_index_bytes() -> None:
+    index = packages.current_index()
+    loaded = packages.DistributionIndex.from_buffer(index.to_bytes())
+    assert dict(loaded.modules) == dict(index.modules)
+    assert dict(loaded.required_by) == dict(index.required_by)
+    assert dict(loaded.rules) == dict(index.rules)
+    with pytest.raises(ValueError, match='not a distribution index'):
+        packages.DistributionIndex.from_buffer(b'\0' * 64)
+    with pytest.raises(ValueError, match='truncated'):
+        packages.DistributionIndex.from_buffer(index.to_bytes()[:10])
+
+def test_index_load(tmp_path: Path) -> None:
+    """The index is scanned once, then loaded until the environment changes"""
+    scan = packages.DistributionIndex.scan
+    with mock.patch.object(packages.DistributionIndex, 'scan', side_effect=scan) as scanned:
+        first = packages.DistributionIndex.load(tmp_path)
+        assert scanned.call_count == 1
+        files = list(tmp_path.glob('index-*.bin'))
+        assert len(files) == 1
+        second = packages.DistributionIndex.load(tmp_path)
+        assert scanned.call_count == 1
+        assert dict(second.modules) == dict(first.modules)
+        # A corrupt file is replaced
+        files[0].write_bytes(b'rubbish')
+        packages.DistributionIndex.load(tmp_path)
+        assert scanned.call_count == 2
+        # A different environment gets a different file, and the old one goes
+        with mock.patch.object(packages, 'environment_fingerprint', return_value='x' * 64):
+            packages.DistributionIndex.load(tmp_path)
+        assert scanned.call_count == 3
+        assert list(tmp_path.glob('index-*.bin')) == [tmp_path / f"index-{'x' * 32}.bin"]
+
+def test_environment_fingerprint(tmp_path: Path) -> None:
+    fingerprint = packages.environment_fingerprint()
+    assert packages.environment_fingerprint() == fingerprint
+    (tmp_path / 'example-1.0.dist-info').mkdir()
+    sys.path.append(str(tmp_path))
+    try:
+        assert packages.environment_fingerprint() != fingerprint
+    finally:
+        sys.path.pop()
+    assert packages.environment_fingerprint() == fingerprint
+
+def test_index_replace_fails(tmp_path: Path) -> None:
+    """If the index file can't be replaced (on Windows, if it's mapped), the existing one is kept"""
+    packages.DistributionIndex.load(tmp_path)
+    [existing] = tmp_path.glob('index-*.bin')
+    existing.write_bytes(b'rubbish')
+    with mock.patch.object(Path, 'replace', side_effect=PermissionError("in use")):
+        index = packages.DistributionIndex.load(tmp_path)
+    assert 'pytest' in index.modules
+    assert list(tmp_path.iterdir()) == [existing]
+    assert existing.read_bytes() == b'rubbish'
+
+def test_environment_fingerprint_editable(tmp_path: Path) -> None:
+    """Adding a module to the source of an editable install changes the environment"""
+    src = write_tree(tmp_path / 'src', ['demo/__init__.py', 'demo/sub/x.py'])
+    site = tmp_path / 'site'
+    site.mkdir()
+    (site / 'demo.pth').write_text(f'{src}\n')
+    sys.path.append(str(site))
+    try:
+        fingerprint = packages.environment_fingerprint()
+        (src / 'demo' / 'sub' / '__pycache__').mkdir()
+        (src / 'demo' / 'sub' / 'notes.txt').write_text('')
+        assert packages.environment_fingerprint() == fingerprint
+        (src / 'demo' / 'sub' / 'y.py').write_text('')
+        assert packages.environment_fingerprint() != fingerprint
+    finally:
+        sys.path.pop()
+
+def test_environment_fingerprint_mtimes(tmp_path: Path) -> None:
+    """Checking out the same source of an editable install again doesn't change the environment"""
+    src = write_tree(tmp_path / 'src', ['demo/__init__.py', 'demo/sub/x.py'])
+    site = tmp_path / 'site'
+    site.mkdir()
+    (site / 'demo.pth').write_text(f'{src}\n')
+    sys.path.append(str(site))
+    try:
+        fingerprint = packages.environment_fingerprint()
+        for path in (src, src / 'demo', src / 'demo' / 'sub', src / 'demo' / 'sub' / 'x.py'):
+            os.utime(path, ns=(0, 0))
+        assert packages.environment_fingerprint() == fingerprint
+    finally:
+        sys.path.pop()
+
+def make_dist(site: Path, name: str, files: Dict[str, str]) -> metadata.Distribution:
+    """An installed distribution whose RECORD lists files, which are written to site"""
+    info = site / f'{name}-1.0.dist-info'
+    info.mkdir(parents=True)
+    (info / 'METADATA').write_text(f'Metadata-Version: 2.1\nName: {name}\nVersion: 1.0\n')
+    (info / 'RECORD').write_text(''.join(f'{file},,\n' for file in files))
+    for file, text in files.items():
+        (site / file).write_text(text)
+    return metadata.PathDistribution(info)
+
+def write_tree(root: Path, files: List[str]) -> Path:
+    for file in files:
+        (root / file).parent.mkdir(parents=True, exist_ok=True)
+        (root / file).write_text('')
+    return root
+
+def test_editable(tmp_path: Path) -> None:
+    """Modern editable installs are read without importing anything"""
+    site = tmp_path / 'site'
+    src = write_tree(tmp_path / 'src', [
+        'sdemo/__init__.py', 'sdemo/sub/x.py', 'sdemo/__pycache__/x.cpython-311.pyc', 'single.py',
+        'pdemo/__init__.py', 'pdemo/y.py', 'notpkg/z.py', 'pmod.py', 'not-a-module.py',
+        'hdemo/__init__.py', 'hdemo/w.py',
+    ])
+    # As written by setuptools
+    setuptools = make_dist(site, 'sdemo', {
+        '__editable__.sdemo-1.0.pth': 'import __editable___sdemo_1_0_finder; __editable___sdemo_1_0_finder.install()\n',
+        '__editable___sdemo_1_0_finder.py': (
+            'raise SystemExit("must not be run")\n'
+            f'MAPPING: dict[str, str] = {{"sdemo": {str(src / "sdemo")!r}, "ns.single": {str(src / "single.py")!r}}}\n'
+        ),
+    })
+    assert sorted(set(packages.distribution_modules(setuptools))) == [
+        ('__editable___sdemo_1_0_finder', 'module'),
+        ('ns', 'finder'), ('ns.single', 'finder'),
+        ('sdemo', 'finder'), ('sdemo.sub', 'finder'), ('sdemo.sub.x', 'finder'),
+    ]
+    # As written by the editables package (used by hatch)
+    editables = make_dist(site, 'hdemo', {
+        '_editable_impl_hdemo.pth': 'import _editable_impl_hdemo\n',
+        '_editable_impl_hdemo.py': (
+            'from editables.redirector import RedirectingFinder as F\nF.install()\n'
+            f'F.map_module("hdemo", {str(src / "hdemo" / "__init__.py")!r})\n'
+        ),
+    })
+    assert ('hdemo.w', 'finder') in set(packages.distribution_modules(editables))
+    # A directory added to the path, relative to site-packages. Only regular
+    # packages are found there.
+    paths = make_dist(site, 'pdemo', {'pdemo.pth': '# comment\n\n../src\n.\nmissing\n'})
+    assert sorted(set(packages.distribution_modules(paths))) == [
+        ('hdemo', 'pth'), ('hdemo.w', 'pth'),
+        ('pdemo', 'pth'), ('pdemo.y', 'pth'),
+        ('pmod', 'pth'),
+        ('sdemo', 'pth'), ('sdemo.sub', 'pth'), ('sdemo.sub.x', 'pth'),
+        ('single', 'pth'),
+    ]
+    with mock.patch.object(metadata, 'distributions', return_value=[setuptools, editables]):
+        index = packages.DistributionIndex.scan()
+    assert index.resolve('sdemo.sub.x.f') == ('sdemo.sub.x', ('sdemo',))
+    assert index.rules['hdemo'] == ('hdemo finder',)
+
+def test_finder_mapping(tmp_path: Path) -> None:
+    finder = tmp_path / 'finder.py'
+    finder.write_text('MAPPING = {"a": "/a", 1: "/b", "c": None}\nOTHER = {"d": "/d"}\nF.map_module("e")\nMAPPING = f()\n')
+    assert packages.finder_mapping(finder) == {'a': Path('/a')}
+    finder.write_text('this is not Python')
+    assert packages.finder_mapping(finder) == {}
+    assert packages.finder_mapping(tmp_path / 'missing.py') == {}
+
+def test_which() -> None:
+    index = packages.DistributionIndex(
+        {'a': ['a-api', 'a-sdk'], 'a.sdk': ['a-sdk']}, {},
+        {'a': ['a-api package', 'a-sdk package'], 'a.sdk': ['a-sdk top_level.txt', 'a-sdk package']},
+    )
+    Provider = packages.Provider
+    assert packages.which('a.sdk.trace', frozenset(), index) == [
+        Provider('a-sdk', 'a.sdk', ('top_level.txt', 'package')),
+    ]
+    assert packages.which('a', frozenset(), index) == [
+        Provider('a-api', 'a', ('package',)), Provider('a-sdk', 'a', ('package',)),
+    ]
+    assert packages.which('a.x', frozenset({'a'}), index) == [Provider('a', 'a', ('local',))]
+    with mock.patch.object(sys, 'path', [str(Path(__file__).parent.parent.parent)]):
+        assert packages.which('omnidep.main', frozenset(), index) == [Provider('omnidep', 'omnidep', ('sys.path',))]
+    with mock.patch.object(sys, 'path', []):
+        assert packages.which('bs4', frozenset(), index) == [Provider('beautifulsoup4', 'bs4', ('known-modules',))]
+        assert packages.which('nonexistent', frozenset(), index) == []
+
+def test_which_command(capsys: pytest.CaptureFixture[str], monkeypatch: pytest.MonkeyPatch) -> None:
+    args = parse_command_line(['which', '_pytest.mark', '-', 'os.path'])
+    assert isinstance(args, WhichCommandLine)
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('pytest\n\n  nonexistent  \n'))
+    assert run(args) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        '_pytest.mark\tpytest\tpackage\t_pytest.mark',
+        'pytest\tpytest\tpackage,top_level.txt\tpytest',
+        'nonexistent\t-\t-\t-',
+        'os.path\tpython\tstdlib\tos',
+    ]
+    assert run(parse_command_line(['which', 'pytest'])) == 0
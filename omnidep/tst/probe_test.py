@@ -0,0 +1,114 @@
+from pathlib import Path
+import subprocess
+import sys
+import time
+from typing import Iterator
+from unittest import mock
+import zipfile
+
+import pytest
+
+from omnidep import probe
+from omnidep.analyzer import Analyzer
+from omnidep.archive import check_archive
+from omnidep.command import parse_command_line
+from omnidep.compact import LayeredMap
+from omnidep.errors import Violation
+from omnidep.main import run
+from omnidep.project import parse_poetry
+
+from .project_test import codes
+
+modules = {
+    # Provided by realdist, according to its RECORD
+    'realmod.py': 'value = 1\n',
+    # Not in any RECORD, but stands in for realmod when imported
+    'alias_mod.py': 'import sys, realmod\nprint("noise")\nsys.modules[__name__] = realmod\n',
+    'broken_mod.py': 'raise RuntimeError("broken")\n',
+    'slow_mod.py': 'import time\ntime.sleep(60)\n',
+    'greedy_mod.py': 'data = bytearray(8 << 30)\n',
+}
+
+@pytest.fixture()
+def site(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    site = tmp_path / 'site'
+    info = site / 'realdist-1.0.dist-info'
+    info.mkdir(parents=True)
+    (info / 'METADATA').write_text('Metadata-Version: 2.1\nName: realdist\nVersion: 1.0\n')
+    (info / 'RECORD').write_text('realmod.py,,\nrealdist-1.0.dist-info/METADATA,,\n')
+    for name, text in modules.items():
+        (site / name).write_text(text)
+    monkeypatch.syspath_prepend(str(site))
+    probe.file_distributions.cache_clear()
+    yield site
+    probe.file_distributions.cache_clear()
+
+def test_probe_file(site: Path) -> None:
+    assert probe.probe_file('alias_mod') == str(site / 'realmod.py')
+    with pytest.raises(probe.ProbeError, match='exit status'):
+        probe.probe_file('broken_mod')
+    with pytest.raises(probe.ProbeError):
+        probe.probe_file('no_such_module')
+    # Attributes aren't modules, so can't be imported
+    with pytest.raises(probe.ProbeError):
+        probe.probe_file('realmod.value')
+    assert probe.probe_file('os.path') is not None
+
+def test_probe_imports_nothing_here(site: Path) -> None:
+    probe.probe_file('alias_mod')
+    assert 'alias_mod' not in sys.modules
+    assert 'realmod' not in sys.modules
+
+def test_timeout(site: Path) -> None:
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        probe.probe_file('slow_mod', timeout=0.5)
+    assert time.monotonic() - start < 10
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="memory limit needs the resource module")
+def test_memory(site: Path) -> None:
+    with pytest.raises(probe.ProbeError):
+        probe.probe_file('greedy_mod', memory=1 << 30)
+
+def test_prober(site: Path, tmp_path: Path) -> None:
+    prober = probe.Prober(cache_dir=tmp_path / 'cache', timeout=0.5)
+    assert prober.distributions(['alias_mod', 'broken_mod', 'slow_mod', 'realmod']) == {
+        'alias_mod': ['realdist'], 'broken_mod': [], 'realmod': ['realdist'], 'slow_mod': [],
+    }
+    # Answers are kept, except for failures and timeouts
+    with mock.patch.object(probe, 'probe_file', return_value=None) as probe_file:
+        again = probe.Prober(cache_dir=tmp_path / 'cache')
+        assert again.distributions(['alias_mod', 'broken_mod', 'slow_mod']) == {
+            'alias_mod': ['realdist'], 'broken_mod': [], 'slow_mod': [],
+        }
+    assert [call.args for call in probe_file.call_args_list] == [('broken_mod',), ('slow_mod',)]
+    # ... until the environment changes
+    with mock.patch.object(probe, 'environment_fingerprint', return_value='x' * 64):
+        assert probe.Prober(cache_dir=tmp_path / 'cache').distributions(['alias_mod']) == {'alias_mod': ['realdist']}
+
+def test_analyzer(site: Path) -> None:
+    project = parse_poetry({'tool': {'poetry': {
+        'dependencies': {'python': '*', 'realdist': '*'},
+        'packages': [],
+    }}})
+    found = {'dependencies': ['alias_mod.value'], 'dev-dependencies': []}
+    assert codes(Analyzer().check_imports(project, found)) == [Violation.ODEP002, Violation.ODEP005]
+    analyzer = Analyzer(probe_imports=True)
+    assert analyzer.check_imports(project, found) == ()
+    probed = analyzer.probed_index(project.value, found)
+    assert probed.rules['alias_mod'] == ('realdist probe',)
+    assert probed.resolve('alias_mod.value') == ('alias_mod', ('realdist',))
+    # The answers are layered over the index, not copied into a new one
+    assert isinstance(probed.modules, LayeredMap)
+    assert probed.modules.base is analyzer.index.modules
+
+def test_archive(site: Path, tmp_path: Path) -> None:
+    """Imports in wheels and sdists are probed too, including from the command line"""
+    wheel = tmp_path / 'example-1.0-py3-none-any.whl'
+    with zipfile.ZipFile(wheel, 'w') as zipped:
+        zipped.writestr('example-1.0.dist-info/METADATA', 'Metadata-Version: 2.1\nName: example\nVersion: 1.0\nRequires-Dist: realdist\n')
+        zipped.writestr('example/__init__.py', 'import alias_mod\n')
+    assert codes(check_archive(wheel)) == [Violation.ODEP002, Violation.ODEP005]
+    assert check_archive(wheel, analyzer=Analyzer(probe_imports=True)) == ()
+    assert run(parse_command_line([str(wheel)])) == 1
+    assert run(parse_command_line([str(wheel), '--probe-imports'])) == 0
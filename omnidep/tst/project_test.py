@@ -1,11 +1,15 @@
 
 from pathlib import Path
+import sys
 from typing import Iterable, List, Tuple
+from unittest import mock
 
 import pytest
 
 from omnidep import project
+from omnidep.command import Config
 from omnidep.errors import Violation, Warn
+from omnidep.packages import DistributionIndex
 
 test_dir = Path(__file__).parent
 root_dir = test_dir.parent.parent
@@ -38,8 +42,11 @@ plain_project_files: List[Tuple[Path, Codes, Codes, Codes]] = [
     (test_dir / 'test_cases/namespace_none_declared', [], [Violation.ODEP004], []),
     (test_dir / 'test_cases/namespace_one_declared', [], [Violation.ODEP003], []),
     (test_dir / 'test_cases/namespace_three_declared', [], [], []),
+    (test_dir / 'test_cases/namespace_submodules', [], [], []),
+    (test_dir / 'test_cases/namespace_submodule_undeclared', [], [Violation.ODEP001], []),
     (test_dir / 'test_cases/parent_child_configured', [], [], []),
     (test_dir / 'test_cases/parent_child_misconfigured', [], [Violation.ODEP001], []),
+    (test_dir / 'test_cases/parent_child_inferred', [], [], []),
 ]
 
 def codes(warnings: Iterable[Warn]) -> Codes:
@@ -55,3 +62,72 @@ def test_known_project_files(projdir: Path, expected: Codes, main: Codes, dev: C
     assert codes(result.value.check_dependencies([])) == main
     assert codes(result.value.check_dev_dependencies([])) == dev
     assert codes(result.value.check_dev_dependencies(None)) == dev
+
+def test_child_packages() -> None:
+    """Configured parents are looked up by child"""
+    config = Config.make({'child-packages': {'a': ['x', 'y'], 'b': ['y']}})
+    proj = project.Project(('a',), (), config)
+    assert proj.parents == {'x': {'a'}, 'y': {'a', 'b'}}
+    assert proj.required('a', {'a'})
+    assert proj.required('x', {'a'})
+    assert proj.required('y', {'b'})
+    assert not proj.required('x', {'b'})
+    assert not proj.required('z', {'a', 'b'})
+
+def test_requiring_parents() -> None:
+    """Suggest parents from installed metadata, but only infer if configured"""
+    index = DistributionIndex(modules={}, required_by={'x': frozenset({'a', 'b', 'c'})})
+    proj = project.Project(('a', 'b'), (), Config.make())
+    assert proj.requiring_parents('x', {'a', 'b'}, index) == ['a', 'b']
+    assert proj.requiring_parents('x', {'d'}, index) == []
+    assert proj.requiring_parents('y', {'a'}, index) == []
+    assert not proj.required('x', {'a', 'b'}, index)
+    proj = project.Project(('a', 'b'), (), Config.make({'infer-child-packages': True}))
+    assert proj.required('x', {'a'}, index)
+    assert not proj.required('x', {'d'}, index)
+
+def test_misconfigured_suggestion() -> None:
+    """ODEP001 mentions an installed parent that requires the missing package"""
+    result = project.read_poetry(test_dir / 'test_cases/parent_child_misconfigured/pyproject.toml')
+    warnings = list(result.value.check_dependencies([]))
+    assert codes(warnings) == [Violation.ODEP001]
+    assert "it is required by ['pytest-cov']" in warnings[0].msg
+
+def test_ignore_subpackage() -> None:
+    """Imports are resolved by the deepest indexed name, and can be ignored by prefix"""
+    index = DistributionIndex(
+        modules={'ns': ['ns-a', 'ns-b'], 'ns.a': ['ns-a'], 'ns.b': ['ns-b']},
+        required_by={},
+    )
+    proj = project.Project(('ns-a',), (), Config.make())
+    assert list(proj.check_dependency_imports(['ns.a.x', 'ns.a.y'], index=index)) == []
+    warnings = list(proj.check_dependency_imports(['ns.a', 'ns.b.c'], index=index))
+    assert codes(warnings) == [Violation.ODEP001]
+    proj = project.Project(('ns-a',), (), Config.make({'ignore-imports': ['ns.b']}))
+    assert list(proj.check_dependency_imports(['ns.a', 'ns.b.c'], index=index)) == []
+    assert not proj.ignore_import('ns.bc')
+
+def test_known_modules() -> None:
+    """Modules that aren't installed can still be checked, if omnidep knows them"""
+    empty = DistributionIndex({}, {})
+    with mock.patch.object(sys, 'path', []):
+        proj = project.Project(('pyyaml',), (), Config.make())
+        assert list(proj.check_dependency_imports(['yaml'], index=empty)) == []
+        warnings = list(proj.check_dependency_imports(['yaml', 'bs4'], index=empty))
+        assert codes(warnings) == [Violation.ODEP001]
+        assert 'beautifulsoup4' in warnings[0].msg
+        # Marked as a guess, since nothing installed says so
+        assert "guessed: 'bs4' isn't installed, and omnidep's built-in list" in warnings[0].msg
+        assert codes(proj.check_dependency_imports(['no_such_module'], index=empty)) == [Violation.ODEP002, Violation.ODEP005]
+
+def test_find_files(tmp_path: Path) -> None:
+    """Each file once, however many paths it's under, and none under exclude"""
+    for name in ('a/b/c.py', 'a/b/d.py', 'a/e.py', 'a/f.txt', 'g.py', 'a/tests/h.py'):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text('')
+    def find(paths: Iterable[str], exclude: Iterable[str] = ()) -> List[str]:
+        found = project.find_files([tmp_path / path for path in paths], [tmp_path / path for path in exclude])
+        return sorted(file.relative_to(tmp_path).as_posix() for file in found)
+    assert find(['a/b', 'a', 'a/b/c.py', 'g.py', 'g.py']) == ['a/b/c.py', 'a/b/d.py', 'a/e.py', 'a/tests/h.py', 'g.py']
+    assert find(['.'], exclude=['a/tests', 'a/b/c.py']) == ['a/b/d.py', 'a/e.py', 'g.py']
+    assert find(['a/tests', 'a/nonexistent'], exclude=['a']) == []
@@ -0,0 +1,152 @@
+import os
+from pathlib import Path
+import time
+from typing import Tuple
+from unittest import mock
+
+import pytest
+
+from omnidep import runcache
+from omnidep.analyzer import Analyzer
+from omnidep.errors import Violation, Warn
+from omnidep.project import read_poetry
+
+from .project_test import codes
+
+pyproject = """\
+[tool.poetry]
+name = "example"
+version = "1.0"
+packages = [{include = "example"}]
+
+[tool.poetry.dependencies]
+python = "*"
+pytest = "*"
+"""
+
+@pytest.fixture()
+def project(tmp_path: Path) -> Path:
+    (tmp_path / 'example').mkdir()
+    (tmp_path / 'example' / '__init__.py').write_text('import pytest\n')
+    (tmp_path / 'example' / 'sub').mkdir()
+    (tmp_path / 'example' / 'sub' / 'code.py').write_text('import example\n')
+    (tmp_path / 'pyproject.toml').write_text(pyproject)
+    return tmp_path
+
+def run(project: Path, *, reads: bool = True, parses: bool = True) -> Tuple[Warn, ...]:
+    """Check project, asserting whether the source files are read, and the project file parsed"""
+    with mock.patch.object(Analyzer, 'find_imports', autospec=True, side_effect=Analyzer.find_imports) as find, \
+         mock.patch('omnidep.runcache.read_poetry', side_effect=read_poetry) as parse:
+        warnings = runcache.RunCache(project / 'cache').check(Analyzer(), project / 'pyproject.toml')
+    assert find.called == reads
+    assert parse.called == parses
+    return warnings
+
+def test_unchanged(project: Path) -> None:
+    assert run(project) == ()
+    assert run(project, reads=False, parses=False) == ()
+
+def test_warnings_kept(project: Path) -> None:
+    (project / 'example' / '__init__.py').write_text('import pytest, coverage\n')
+    warnings = run(project)
+    assert codes(warnings) == [Violation.ODEP001]
+    assert run(project, reads=False, parses=False) == warnings
+
+def test_project_changed(project: Path) -> None:
+    """Only the check is repeated, using the imports from last time"""
+    run(project)
+    (project / 'pyproject.toml').write_text(pyproject.replace('pytest', 'coverage = "*"\npytest'))
+    assert codes(run(project, reads=False)) == [Violation.ODEP005]
+    assert codes(run(project, reads=False, parses=False)) == [Violation.ODEP005]
+
+def test_environment_changed(project: Path) -> None:
+    run(project)
+    with mock.patch.object(runcache, 'environment_fingerprint', return_value='changed'):
+        assert run(project, reads=False) == ()
+
+def test_roots_changed(project: Path) -> None:
+    run(project)
+    (project / 'pyproject.toml').write_text(pyproject + '[tool.omnidep]\nlocal-test-paths = ["example/sub"]\n')
+    assert run(project) == ()
+
+@pytest.mark.parametrize('change', ['edit', 'add', 'remove', 'add_dir'])
+def test_source_changed(project: Path, change: str) -> None:
+    run(project)
+    code = project / 'example' / 'sub' / 'code.py'
+    if change == 'edit':
+        code.write_text('import coverage\n')
+    elif change == 'add':
+        (code.parent / 'more.py').write_text('import coverage\n')
+    elif change == 'remove':
+        (project / 'example' / '__init__.py').unlink()
+    else:
+        (code.parent / 'more').mkdir()
+    expected = {
+        'edit': [Violation.ODEP001],
+        'add': [Violation.ODEP001],
+        'remove': [Violation.ODEP005],
+        'add_dir': [],
+    }[change]
+    assert codes(run(project)) == expected
+
+def test_irrelevant_change(project: Path) -> None:
+    """Only directories and .py files matter"""
+    run(project)
+    (project / 'example' / 'README').write_text('import coverage\n')
+    assert run(project, reads=False, parses=False) == ()
+
+def test_fresh_checkout(project: Path) -> None:
+    """Different times, same contents, is unchanged"""
+    run(project)
+    earlier = time.time_ns() - 100 * runcache.RACY_NS
+    for path in [project, *project.rglob('*')]:
+        os.utime(path, ns=(earlier, earlier))
+    assert run(project, reads=False, parses=False) == ()
+    # The new times are recorded, so the contents needn't be checked again.
+    digest = runcache._file_digest
+    def source_not_digested(path: Path) -> str:
+        assert path.name == 'pyproject.toml'
+        return digest(path)
+    with mock.patch.object(runcache, '_file_digest', side_effect=source_not_digested):
+        assert run(project, reads=False, parses=False) == ()
+
+def test_bad_record(project: Path) -> None:
+    run(project)
+    for record in (project / 'cache').glob('run-*.json'):
+        record.write_text('{"omnidep-run": 1}')
+    assert run(project) == ()
+    assert run(project, reads=False, parses=False) == ()
+
+def test_scan(tmp_path: Path) -> None:
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'x.py').write_text('')
+    (tmp_path / 'a' / 'x.txt').write_text('')
+    (tmp_path / 'b.py').write_text('')
+    # Links to directories aren't followed, as when finding source files.
+    (tmp_path / 'a' / 'loop').symlink_to(tmp_path / 'a')
+    (tmp_path / 'elsewhere').mkdir()
+    (tmp_path / 'elsewhere' / 'y.py').write_text('')
+    (tmp_path / 'a' / 'link').symlink_to(tmp_path / 'elsewhere')
+    started = time.time_ns()
+    tree = runcache.Tree.scan([tmp_path / 'a', tmp_path / 'b.py', tmp_path / 'c'], started)
+    assert sorted(tree.files) == [str(tmp_path / 'a' / 'x.py'), str(tmp_path / 'b.py')]
+    assert sorted(tree.dirs) == [str(tmp_path / 'a')]
+    assert tree.missing == [str(tmp_path / 'c')]
+    # These were all modified too recently to trust their times.
+    assert all(stamp[0] is None for stamp in [*tree.files.values(), *tree.dirs.values()])
+    refreshed = tree.refresh(started + 10 * runcache.RACY_NS)
+    assert refreshed is not None
+    assert all(stamp[0] is not None for stamp in refreshed.files.values())
+    (tmp_path / 'c').mkdir()
+    assert tree.refresh(started) is None
+    (tmp_path / 'c').rmdir()
+    (tmp_path / 'b.py').unlink()
+    assert tree.refresh(started) is None
+
+def test_code_fingerprint(tmp_path: Path) -> None:
+    """Data files shipped with omnidep count as code"""
+    (tmp_path / 'code.py').write_text('')
+    (tmp_path / 'known_modules.txt').write_text('a a\n')
+    before = runcache.code_fingerprint(tmp_path)
+    (tmp_path / 'known_modules.txt').write_text('a b c\n')
+    assert runcache.code_fingerprint(tmp_path) != before
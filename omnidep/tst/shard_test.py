@@ -0,0 +1,134 @@
+import argparse
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from omnidep import project, shard
+from omnidep.command import CommandLine, MergeCommandLine, parse_command_line
+from omnidep.errors import ConfigError
+from omnidep.main import run
+
+from .archive_test import make_wheel
+from .project_test import Codes, codes, plain_project_files
+
+test_dir = Path(__file__).parent
+root_dir = test_dir.parent.parent
+
+def test_parse() -> None:
+    assert shard.Shard.parse('1/1') == shard.Shard(1, 1)
+    assert shard.Shard.parse('3/4') == shard.Shard(3, 4)
+    assert str(shard.Shard(3, 4)) == '3/4'
+
+@pytest.mark.parametrize('text', ['', '1', '0/4', '5/4', '1/0', 'a/b', '1/2/3', '-1/2'])
+def test_parse_invalid(text: str) -> None:
+    with pytest.raises(argparse.ArgumentTypeError):
+        shard.Shard.parse(text)
+
+def test_partition() -> None:
+    """Every file must be in exactly one shard, regardless of the root"""
+    files = sorted(root_dir.glob('**/*.py'))
+    shards = [shard.Shard(idx, 3) for idx in (1, 2, 3)]
+    selected = [s.select(files, root_dir) for s in shards]
+    assert sorted(sum(selected, [])) == files
+    assert all(selected)
+    # Same relative paths under a different root give the same partition
+    moved = [Path('elsewhere') / file.relative_to(root_dir) for file in files]
+    assert [s.select(moved, Path('elsewhere')) for s in shards] == [
+        [Path('elsewhere') / file.relative_to(root_dir) for file in part]
+        for part in selected
+    ]
+
+def test_command_line() -> None:
+    args = parse_command_line(['pyproject.toml', '--shard', '2/3', '--output', 'out.jsonl'])
+    assert isinstance(args, CommandLine)
+    assert args.shard == shard.Shard(2, 3)
+    assert args.output == Path('out.jsonl')
+    args = parse_command_line(['merge', 'pyproject.toml', 'a.jsonl', 'b.jsonl'])
+    assert isinstance(args, MergeCommandLine)
+    assert args.paths == [Path('pyproject.toml'), Path('a.jsonl'), Path('b.jsonl')]
+
+def write_shards(tmp_path: Path, toml_file: Path, count: int) -> List[Path]:
+    outputs = [tmp_path / f'partial-{idx}.jsonl' for idx in range(1, count + 1)]
+    for idx, output in enumerate(outputs, 1):
+        args = parse_command_line([str(toml_file), '--shard', f'{idx}/{count}', '--output', str(output)])
+        assert run(args) == 0
+    return outputs
+
+@pytest.mark.parametrize('count', [1, 2, 5])
+def test_merge_self(tmp_path: Path, count: int) -> None:
+    """Merged shards must find the same imports as the whole project"""
+    toml_file = root_dir / 'pyproject.toml'
+    partial = shard.read_partials(write_shards(tmp_path, toml_file, count))
+    assert partial.shards == {shard.Shard(idx, count) for idx in range(1, count + 1)}
+    loaded = project.read_poetry(toml_file).value
+    whole = shard.find_imports(loaded, [], None, shard=shard.Shard(1, 1), root=root_dir)
+    assert partial.modules(shard.DEPENDENCIES) == whole[shard.DEPENDENCIES]
+    assert partial.modules(shard.DEV_DEPENDENCIES) == whole[shard.DEV_DEPENDENCIES]
+    assert 'pytest' in partial.modules(shard.DEV_DEPENDENCIES)
+    assert 'pytest' not in partial.modules(shard.DEPENDENCIES)
+
+@pytest.mark.parametrize('projdir,expected,main,dev', plain_project_files)
+def test_merge_known_project_files(tmp_path: Path, projdir: Path, expected: Codes, main: Codes, dev: Codes) -> None:
+    """Merging must give the same warnings as checking the whole project"""
+    toml_file = projdir / 'pyproject.toml'
+    partial = shard.read_partials(write_shards(tmp_path, toml_file, 2))
+    assert codes(partial.check(project.read_poetry(toml_file))) == expected + main + dev
+
+def test_missing_shard(tmp_path: Path) -> None:
+    toml_file = root_dir / 'pyproject.toml'
+    outputs = write_shards(tmp_path, toml_file, 3)
+    partial = shard.read_partials(outputs[:1] + outputs[2:])
+    assert partial.missing_shards() == [shard.Shard(2, 3)]
+    with pytest.raises(ConfigError, match='shard.*2/3'):
+        partial.check(project.read_poetry(toml_file))
+    args = parse_command_line(['merge', str(toml_file), *map(str, outputs[:2])])
+    with pytest.raises(ConfigError, match='shard.*3/3'):
+        run(args)
+
+def test_mismatched_shards(tmp_path: Path) -> None:
+    toml_file = root_dir / 'pyproject.toml'
+    outputs = write_shards(tmp_path, toml_file, 2)[:1]
+    outputs.append(tmp_path / 'other.jsonl')
+    shard.write_partial(outputs[-1], shard.Shard(1, 3), {})
+    with pytest.raises(ConfigError, match='different numbers of shards'):
+        shard.read_partials(outputs).missing_shards()
+
+@pytest.mark.parametrize('content', ['', 'not json\n', '[]\n', '{"omnidep-partial": 0}\n', '{"omnidep-partial": 1}\n{}\n'])
+def test_bad_partial(tmp_path: Path, content: str) -> None:
+    bad_file = tmp_path / 'bad.jsonl'
+    bad_file.write_text(content)
+    with pytest.raises(ConfigError, match='not a partial result file'):
+        shard.read_partials([bad_file])
+
+def test_no_partials(tmp_path: Path) -> None:
+    """No partials, or a shell glob that matched nothing, is an error"""
+    toml_file = root_dir / 'pyproject.toml'
+    with pytest.raises(ConfigError, match='No partial result files'):
+        run(parse_command_line(['merge', str(toml_file)]))
+    with pytest.raises(ConfigError, match="Can't read partial result file .*partial-\\*"):
+        run(parse_command_line(['merge', str(toml_file), str(tmp_path / 'partial-*.jsonl')]))
+
+def test_append(tmp_path: Path) -> None:
+    """Partial files without shards can be built up a bit at a time"""
+    output = tmp_path / 'partial.jsonl'
+    shard.write_partial(output, None, {shard.DEPENDENCIES: ['a', 'b']}, append=True)
+    shard.write_partial(output, None, {shard.DEPENDENCIES: ['c'], shard.DEV_DEPENDENCIES: ['d']}, append=True)
+    partial = shard.read_partials([output])
+    assert partial.shards == frozenset()
+    assert partial.missing_shards() == []
+    assert partial.modules(shard.DEPENDENCIES) == ['a', 'b', 'c']
+    assert partial.modules(shard.DEV_DEPENDENCIES) == ['d']
+
+def test_shard_requires_output() -> None:
+    args = parse_command_line([str(root_dir / 'pyproject.toml'), '--shard', '1/2'])
+    with pytest.raises(SystemExit, match='--output'):
+        run(args)
+
+def test_shard_with_archive(tmp_path: Path) -> None:
+    """Wheels and sdists can't be split into shards"""
+    wheel = make_wheel(tmp_path / 'example-1.0-py3-none-any.whl', {'example/__init__.py': 'import pytest\n'})
+    args = parse_command_line([str(wheel), '--shard', '1/1', '--output', str(tmp_path / 'partial.jsonl')])
+    with pytest.raises(SystemExit, match='wheels or sdists'):
+        run(args)
+    assert not (tmp_path / 'partial.jsonl').exists()
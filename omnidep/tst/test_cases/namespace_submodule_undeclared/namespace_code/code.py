@@ -0,0 +1,4 @@
+
+# opentelemetry.sdk is provided by opentelemetry-sdk, not opentelemetry-api.
+from opentelemetry import trace  # noqa: F401
+from opentelemetry.sdk.resources import Resource  # noqa: F401
@@ -0,0 +1,5 @@
+
+# Each of these parts of the namespace package "opentelemetry" is provided by
+# just one distribution.
+from opentelemetry import trace  # noqa: F401
+import opentelemetry.sdk.resources  # noqa: F401